@@ -0,0 +1,237 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+from collections import Counter
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+
+__all__ = [
+    "PRIORITY_CRITICAL",
+    "PRIORITY_LOW",
+    "PRIORITY_NORMAL",
+    "AdmissionControlMiddleware",
+    "AdmissionController",
+    "get_stats",
+]
+
+# 数字越小优先级越高
+PRIORITY_CRITICAL = 0  # 健康检查、静态文件，不受并发上限限制
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # 重的接口，只能用 max_concurrency - reserved 个槽位
+
+STATIC_SUFFIXES = (
+    ".html",
+    ".js",
+    ".css",
+    ".map",
+    ".json",
+    ".txt",
+    ".ico",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".svg",
+    ".webp",
+    ".woff",
+    ".woff2",
+)
+
+_controller = None
+
+
+def get_stats():
+    return _controller.stats() if _controller is not None else None
+
+
+def _is_event_stream(message):
+    for key, value in message.get("headers", ()):
+        if key.lower() == b"content-type":
+            return value.startswith(b"text/event-stream")
+    return False
+
+
+class AdmissionController:
+    """
+    每个 worker 的并发上限加一个有界的等待队列
+
+    槽位满了以后请求按优先级排队，同优先级先来先得；队列满或者等待超时直接失败
+    PRIORITY_LOW 的请求最多占 max_concurrency - reserved 个槽位，剩下的留给普通请求
+    """
+
+    def __init__(self, max_concurrency, queue_size, queue_timeout, reserved=0):
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.limits = {
+            PRIORITY_NORMAL: max_concurrency,
+            PRIORITY_LOW: max(1, max_concurrency - reserved),
+        }
+        self.in_flight = 0
+        self._waiters = []
+        self._queued = Counter()
+        self._seq = itertools.count()
+        self.counters = Counter()
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "queue_depth": self._queued.total(), **self.counters}
+
+    def _can_admit(self, priority):
+        return self.in_flight < self.limits[priority]
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        """拿到槽位返回 True，被拒绝返回 False；拿到以后必须调用 release"""
+        if priority == PRIORITY_CRITICAL:
+            self.counters["admitted"] += 1
+            return True
+
+        # 前面没有同级或更高优先级的在排队才能直接进
+        ahead = sum(n for p, n in self._queued.items() if p <= priority)
+        if self._can_admit(priority) and not ahead:
+            self.in_flight += 1
+            self.counters["admitted"] += 1
+            return True
+
+        if self._queued.total() >= self.queue_size:
+            self.counters["shed_queue_full"] += 1
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued[priority] += 1
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # 客户端断开之类的取消，已经分到的槽位要还回去
+            if future.done() and not future.cancelled():
+                self.release(PRIORITY_NORMAL)
+            else:
+                self._abandon(future, priority)
+            raise
+
+        if future.done():
+            self.counters["admitted"] += 1
+            self.counters["queued"] += 1
+            return True
+        self._abandon(future, priority)
+        self.counters["shed_timeout"] += 1
+        return False
+
+    def _abandon(self, future, priority):
+        future.cancel()
+        self._queued[priority] -= 1
+        # 堆里的 future 留着，_wake 时跳过
+
+    def release(self, priority=PRIORITY_NORMAL):
+        if priority == PRIORITY_CRITICAL:
+            return
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_admit(priority):
+                break
+            heapq.heappop(self._waiters)
+            self._queued[priority] -= 1
+            self.in_flight += 1
+            future.set_result(True)
+
+
+class AdmissionControlMiddleware:
+    """
+    过载时快速失败，而不是让所有请求一起变慢：超过并发上限的请求排队，
+    排不上或者等太久返回 503 + Retry-After
+
+    priorities: [(路径前缀, 优先级)]，没有匹配的按后缀判断，静态文件是 PRIORITY_CRITICAL，其他是 PRIORITY_NORMAL
+    exempt: 不做控制的路径前缀，RowStreamResponse 导出这种一个请求要跑很久的接口放这里
+    max_concurrency 为 0 时不做控制
+
+    SSE（text/event-stream）开始推送以后就把槽位还回去，不然每个连着的客户端都一直占一个槽位；
+    websocket 不经过这里
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_concurrency=None,
+        queue_size=None,
+        queue_timeout=None,
+        reserved=None,
+        priorities=(("/health", PRIORITY_CRITICAL),),
+        exempt=None,
+    ):
+        global _controller
+        self.app = app
+        max_concurrency = max_concurrency if max_concurrency is not None else settings.admission_max_concurrency
+        self.controller = None
+        if max_concurrency > 0:
+            self.controller = _controller = AdmissionController(
+                max_concurrency,
+                queue_size if queue_size is not None else settings.admission_queue_size,
+                queue_timeout if queue_timeout is not None else settings.admission_queue_timeout,
+                reserved if reserved is not None else settings.admission_reserved,
+            )
+        self.priorities = sorted(priorities, key=lambda item: len(item[0]), reverse=True)
+        self.exempt = tuple(exempt if exempt is not None else settings.admission_exempt_paths)
+
+    def classify(self, path):
+        for prefix, priority in self.priorities:
+            if path.startswith(prefix):
+                return priority
+        if os.path.splitext(path)[1].lower() in STATIC_SUFFIXES:
+            return PRIORITY_CRITICAL
+        return PRIORITY_NORMAL
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            self.controller is None
+            or scope["type"] != "http"
+            or (self.exempt and scope["path"].startswith(self.exempt))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        priority = self.classify(scope["path"])
+        if not await self.controller.acquire(priority):
+            await self.reject(send)
+            return
+
+        released = False
+
+        async def send_wrapper(message):
+            nonlocal released
+            if message["type"] == "http.response.start" and not released and _is_event_stream(message):
+                released = True
+                self.controller.release(priority)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not released:
+                self.controller.release(priority)
+
+    @staticmethod
+    async def reject(send: Send):
+        body = json.dumps({"detail": "Service Unavailable"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(settings.admission_retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,224 @@
+import zlib
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+__all__ = ["CompressionMiddleware"]
+
+DEFAULT_CONTENT_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+# SSE 每条消息都要马上到客户端，压缩器的缓冲和代理对压缩流的处理都可能把它憋住
+EXCLUDED_CONTENT_TYPES = ("text/event-stream",)
+
+
+class GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self, level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data, final):
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data, final):
+        out = self._obj.process(data)
+        return out + (self._obj.finish() if final else self._obj.flush())
+
+
+class ZstdCompressor:
+    encoding = "zstd"
+
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data, final):
+        out = self._obj.compress(data)
+        return out + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+def available_encodings():
+    # 同样的 q 值时按这个顺序优先
+    encodings = {}
+    if zstandard is not None:
+        encodings["zstd"] = lambda: ZstdCompressor(settings.compression_zstd_level)
+    if brotli is not None:
+        encodings["br"] = lambda: BrotliCompressor(settings.compression_brotli_quality)
+    encodings["gzip"] = lambda: GzipCompressor(settings.compression_gzip_level)
+    return encodings
+
+
+def select_encoding(accept_encoding, encodings):
+    """按 Accept-Encoding 的 q 值选编码，q 相同时按 encodings 的顺序"""
+    explicit = {}
+    wildcard = 0.0
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name == "*":
+            wildcard = q
+        else:
+            explicit[name] = q
+
+    best, best_q = None, 0.0
+    for name in encodings:
+        q = explicit.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    响应压缩，支持 gzip，装了 brotli / zstandard 时也支持 br / zstd
+
+    - 小于 minimum_size 的不压
+    - 只压 content_types 里的类型，图片、压缩包之类的不压
+    - 已经有 Content-Encoding 的不压（包括预压缩的静态文件），handler 可以设置
+      Content-Encoding: identity 单独关掉某个响应的压缩，这个头不会发给客户端；exclude_paths 按路径前缀关掉
+    - SSE 不压；206 和带 Content-Range 的不压，range 是按原始字节算的
+    - StreamingResponse 边收边压，每块都 flush，客户端不用等到最后
+    - 大于 offload_size 的块放到线程池里压，不占 event loop
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size=None,
+        offload_size=None,
+        content_types=DEFAULT_CONTENT_TYPES,
+        exclude_paths=(),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else settings.compression_minimum_size
+        self.offload_size = offload_size if offload_size is not None else settings.compression_offload_size
+        self.content_types = tuple(content_types)
+        self.exclude_paths = tuple(exclude_paths)
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = None
+        if not (self.exclude_paths and scope["path"].startswith(self.exclude_paths)):
+            encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        # 不压缩时也要经过 responder，去掉 handler 设置的 Content-Encoding: identity
+        responder = _CompressionResponder(self, send, encoding)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware, send, encoding):
+        self.middleware = middleware
+        self._send = send
+        self.encoding = encoding
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    def eligible(self, status, headers):
+        if self.encoding is None or "content-encoding" in headers:
+            return False
+        if status == 206 or "content-range" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        if content_type.startswith(EXCLUDED_CONTENT_TYPES):
+            return False
+        return content_type.startswith(self.middleware.content_types)
+
+    async def compress(self, data, final):
+        if len(data) >= self.middleware.offload_size:
+            return await anyio.to_thread.run_sync(self.compressor.compress, data, final)
+        return self.compressor.compress(data, final)
+
+    def start_compressing(self):
+        self.compressor = self.middleware.encodings[self.encoding]()
+        headers = MutableHeaders(scope=self.start_message)
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        # 压缩以后字节变了，强 ETag 要变成弱 ETag
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        return headers
+
+    async def send(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = MutableHeaders(scope=message)
+            if headers.get("content-encoding", "").lower() == "identity":
+                # 只是给这个中间件的标记
+                del headers["content-encoding"]
+                self.passthrough = True
+            else:
+                self.passthrough = not self.eligible(message["status"], headers)
+            if self.passthrough:
+                await self._send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not more_body:
+                # 一次性的响应
+                if len(body) < self.middleware.minimum_size:
+                    self.passthrough = True
+                    await self._send(self.start_message)
+                    await self._send(message)
+                    return
+                headers = self.start_compressing()
+                body = await self.compress(body, final=True)
+                headers["Content-Length"] = str(len(body))
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+
+            # 流式响应，长度未知
+            headers = self.start_compressing()
+            del headers["Content-Length"]
+            await self._send(self.start_message)
+
+        body = await self.compress(body, final=not more_body)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -0,0 +1,67 @@
+import hashlib
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+__all__ = ["conditional_response", "etag_matches", "make_etag", "not_modified"]
+
+
+def make_etag(body=None, version=None):
+    """有 version 时用 version，不用序列化 body；否则对 body 做 hash"""
+    data = str(version).encode() if version is not None else body
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 用弱比较，压缩中间件会把 ETag 变成 W/ 开头的"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _not_modified_response(etag, cache_control):
+    headers = {"ETag": etag}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return Response(status_code=304, headers=headers)
+
+
+def not_modified(request: Request, version, cache_control="no-cache"):
+    """
+    提前退出用，handler 先拿到版本号（比如表的 updated_at 最大值），没变就不用查数据、拼 payload
+
+        if (resp := not_modified(request, version)) is not None:
+            return resp
+
+    没有命中返回 None，之后用同一个 version 调 conditional_response
+    """
+    etag = make_etag(version=version)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _not_modified_response(etag, cache_control)
+    return None
+
+
+def conditional_response(request: Request, content, version=None, status_code=200, cache_control="no-cache"):
+    """
+    返回带 ETag 的 JSONResponse，客户端带的 If-None-Match 对得上时返回没有 body 的 304
+
+    cache_control 默认 no-cache：浏览器每次都会带着 ETag 来问，但没变时只回一个 304
+    """
+    response = None
+    if version is not None:
+        # 有版本号时 304 不用序列化
+        etag = make_etag(version=version)
+    else:
+        response = JSONResponse(content, status_code=status_code)
+        etag = make_etag(response.body)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _not_modified_response(etag, cache_control)
+    if response is None:
+        response = JSONResponse(content, status_code=status_code)
+    response.headers["ETag"] = etag
+    if cache_control:
+        response.headers["Cache-Control"] = cache_control
+    return response
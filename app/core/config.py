@@ -6,6 +6,79 @@ class Settings(BaseSettings):
     enable_cors: bool = False
     log_rotation_size: int = 10_000_000
     log_rotation_time: str = "00:00"
+    # 单进程时文件日志由后台线程写，log_overflow: block / drop_new / drop_old
+    log_background_writer: bool = True
+    log_queue_size: int = 10000
+    log_overflow: str = "block"
+    log_batch_size: int = 1000
+    scheduler_lock_dir: str = "logs"
+    scheduler_lock_name: str = "scheduler"
+    scheduler_max_workers: int = 4
+    scheduler_failover_interval: float = 5.0
+    rate_limit_enabled: bool = False
+    rate_limit_redis_url: str = ""
+    rate_limit_rate: float = 20.0
+    rate_limit_burst: int = 40
+    rate_limit_lease: int = 5
+    # redis 出错以后多少秒内直接用本地令牌桶
+    rate_limit_redis_timeout: float = 0.2
+    rate_limit_redis_cooldown: float = 5.0
+    server_timing_enabled: bool = True
+    slow_request_ms: float = 1000.0
+    profiler_duration: float = 30.0
+    profiler_rate: int = 100
+    profiler_dir: str = "logs"
+    loop_watchdog_enabled: bool = True
+    loop_watchdog_interval: float = 0.5
+    loop_lag_threshold_ms: float = 200.0
+    # 每隔多少秒把延迟直方图写一行日志，0 不写
+    loop_lag_report_interval: float = 60.0
+    compression_minimum_size: int = 1024
+    compression_offload_size: int = 256 * 1024
+    compression_gzip_level: int = 6
+    compression_brotli_quality: int = 4
+    compression_zstd_level: int = 3
+    admission_max_concurrency: int = 100
+    admission_queue_size: int = 200
+    admission_queue_timeout: float = 5.0
+    admission_reserved: int = 10
+    admission_retry_after: int = 1
+    # 导出之类的长时间流式接口，不受并发上限限制
+    admission_exempt_paths: list[str] = []
+
+    # worker 之间共享的内存缓存，大小是 buckets * ways * (32 + key_size + value_size)
+    shm_cache_enabled: bool = True
+    shm_cache_buckets: int = 1024
+    shm_cache_ways: int = 8
+    shm_cache_key_size: int = 64
+    shm_cache_value_size: int = 512
+
+    # broker 不可用时消息先写到本地文件
+    outbox_dir: str = "logs/outbox"
+    outbox_max_bytes: int = 64 * 1024 * 1024
+    outbox_fsync_interval: float = 0.2
+    outbox_retry_interval: float = 2.0
+    # 请求路径上连 broker 的超时，失败不重试直接落盘；后台线程每 probe_interval 秒主动检查一次 broker
+    outbox_send_timeout: float = 1.0
+    outbox_probe_interval: float = 5.0
+    # broker 正常但一条消息一直发不出去，重试这么多次以后移到 .dead 文件
+    outbox_max_attempts: int = 5
+
+    # main.py --consumers N 启动的消费者进程，这些模块里用 @consumer 注册回调
+    consumer_modules: list[str] = []
+    consumer_restart_backoff: float = 1.0
+    consumer_stable_time: float = 10.0
+    consumer_shutdown_timeout: float = 30.0
+
+    # keyset 分页每页最多多少条
+    pagination_max_limit: int = 100
+
+    # 推送给 SSE / websocket 客户端的事件，每个 worker 一个 redis 订阅
+    fanout_redis_url: str = "redis://127.0.0.1:6379/3"
+    fanout_channel_prefix: str = "fanout."
+    fanout_queue_size: int = 100
+    fanout_policy: str = "coalesce"
+    fanout_heartbeat: float = 15.0
 
 
 settings = Settings()
@@ -0,0 +1,158 @@
+import importlib
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from app.core.config import settings
+from app.core.log import logger, setup_logging
+
+__all__ = ["ConsumerSupervisor", "consumer", "get_bindings", "load_consumer_modules", "register"]
+
+# [(routing_key, "module:qualname")]，只存名字，spawn 出来的子进程自己 import
+_bindings = []
+
+
+def register(routing_key, callback):
+    binding = (routing_key, f"{callback.__module__}:{callback.__qualname__}")
+    if binding not in _bindings:
+        _bindings.append(binding)
+    return callback
+
+
+def consumer(routing_key):
+    """
+    注册一个消费者，--consumers N 启动的每个消费者进程都会 Worker.on(routing_key, func)
+
+        @consumer("foo.test")
+        def foo_cb(body, message):
+            message.ack()
+
+    func 所在的模块要放到 settings.consumer_modules 里，父进程启动时 import 一遍才能注册上
+    """
+
+    def decorator(func):
+        return register(routing_key, func)
+
+    return decorator
+
+
+def get_bindings():
+    return list(_bindings)
+
+
+def load_consumer_modules(modules=None):
+    for name in modules if modules is not None else settings.consumer_modules:
+        importlib.import_module(name)
+    return get_bindings()
+
+
+def _resolve(path):
+    module_name, _, qualname = path.partition(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _consumer_main(handlers, bindings):
+    """消费者子进程的入口，和 MyConfig 一样，用父进程传过来的 handlers 写文件日志"""
+    from app.core.kombu_message import Worker, connection
+    from app.core.middleware import patch_log
+
+    logger._core.handlers = handlers
+    logger.configure(patcher=patch_log)
+    logger.add(sys.stderr, level=logging.INFO)
+    setup_logging()
+
+    with connection.clone() as conn:
+        worker = Worker(conn)
+
+        def stop(signum, frame):
+            # 处理完手上的消息再退出
+            logger.info(f"consumer {multiprocessing.current_process().name} stopping")
+            worker.should_stop = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for routing_key, path in bindings:
+            worker.on(routing_key, _resolve(path))
+        logger.info(f"consumer {multiprocessing.current_process().name} started, {len(bindings)} bindings")
+        worker.run()
+
+
+class ConsumerSupervisor:
+    """
+    在父进程里管理 N 个消费者进程，和 uvicorn 的 worker 一样用 spawn 启动
+
+    子进程异常退出会重启，连续很快挂掉时重启间隔指数增加；stop 时先 SIGTERM 等它处理完，超时再 kill
+    """
+
+    def __init__(self, count, bindings, handlers, target=_consumer_main, check_interval=0.5):
+        self.count = count
+        self.bindings = bindings
+        self.handlers = handlers
+        self.target = target
+        self.check_interval = check_interval
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = [None] * count
+        self._started_at = [0.0] * count
+        self._crashes = [0] * count
+        self._restart_at = [0.0] * count
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        for i in range(self.count):
+            self._spawn(i)
+        self._thread = threading.Thread(target=self._monitor, name="consumer-supervisor", daemon=True)
+        self._thread.start()
+
+    def _spawn(self, i):
+        process = self.context.Process(
+            target=self.target, args=(self.handlers, self.bindings), name=f"consumer-{i}", daemon=False
+        )
+        process.start()
+        self.processes[i] = process
+        self._started_at[i] = time.monotonic()
+        logger.info(f"started consumer-{i} pid {process.pid}")
+
+    def _monitor(self):
+        while not self._stop.wait(self.check_interval):
+            now = time.monotonic()
+            for i, process in enumerate(self.processes):
+                if process.is_alive() or self._stop.is_set():
+                    continue
+                if not self._restart_at[i]:
+                    uptime = now - self._started_at[i]
+                    self._crashes[i] = self._crashes[i] + 1 if uptime < settings.consumer_stable_time else 1
+                    delay = min(settings.consumer_restart_backoff * 2 ** (self._crashes[i] - 1), 30)
+                    self._restart_at[i] = now + delay
+                    logger.warning(
+                        f"consumer-{i} pid {process.pid} exited with {process.exitcode}, restart in {delay}s"
+                    )
+                if now >= self._restart_at[i]:
+                    self._restart_at[i] = 0.0
+                    self._spawn(i)
+
+    def stop(self, timeout=None):
+        timeout = timeout if timeout is not None else settings.consumer_shutdown_timeout
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for i, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"consumer-{i} pid {process.pid} did not exit in {timeout}s, killing")
+                process.kill()
+                process.join()
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import re
+import weakref
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from kombu.transport.virtual.exchange import TopicExchange
+from starlette.responses import StreamingResponse
+
+from app.core.config import settings
+from app.core.log import logger
+
+__all__ = [
+    "POLICY_COALESCE",
+    "POLICY_DROP",
+    "FanoutHub",
+    "broadcast",
+    "broadcast_sync",
+    "close_subscriptions",
+    "get_hub",
+    "sse_response",
+    "stop_hub",
+    "topic_matches",
+    "websocket_pump",
+]
+
+# 客户端的队列满了以后
+POLICY_DROP = "drop"  # 断开这个客户端，前端重连以后重新拉一次全量
+POLICY_COALESCE = "coalesce"  # 同一个 routing key 只保留最新的一条，还放不下就丢最老的
+
+
+# 和 Worker.on 用的 redis transport 一样的匹配规则，直接用 kombu 的实现，两边不会不一致
+_topic_exchange = TopicExchange(None)
+
+
+@lru_cache(maxsize=4096)
+def _topic_regex(pattern):
+    return re.compile(_topic_exchange.key_to_pattern(pattern))
+
+
+def topic_matches(pattern, routing_key):
+    """和 Worker.on 一样用 kombu TopicExchange 的正则: # 匹配任意字符，* 匹配以非 . 结尾的任意字符，都可以跨过 ." """
+    return _topic_regex(pattern).match(routing_key) is not None
+
+
+class Subscription:
+    """一个客户端的订阅，dispatch 只会 put_nowait，慢的客户端不会拖慢别人"""
+
+    def __init__(self, patterns, maxsize, policy):
+        self.patterns = tuple(patterns)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.closed = False
+        self.dropped = 0
+        self._queue = OrderedDict() if policy == POLICY_COALESCE else deque()
+        self._event = asyncio.Event()
+
+    def matches(self, routing_key):
+        return any(topic_matches(pattern, routing_key) for pattern in self.patterns)
+
+    def put_nowait(self, routing_key, data):
+        if self.closed:
+            return
+        if self.policy == POLICY_COALESCE:
+            if routing_key in self._queue:
+                # 旧的还没发出去，直接换成新的，位置不变
+                self._queue[routing_key] = data
+                self.dropped += 1
+            else:
+                if len(self._queue) >= self.maxsize:
+                    self._queue.popitem(last=False)
+                    self.dropped += 1
+                self._queue[routing_key] = data
+        else:
+            if len(self._queue) >= self.maxsize:
+                self.dropped += 1
+                self.close()
+                return
+            self._queue.append((routing_key, data))
+        self._event.set()
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            await self._event.wait()
+        if self.closed and self.policy == POLICY_DROP:
+            # 被踢掉的客户端不用再把积压的发完
+            raise StopAsyncIteration
+        if self.policy == POLICY_COALESCE:
+            return self._queue.popitem(last=False)
+        return self._queue.popleft()
+
+    async def get(self, timeout=None):
+        """超时或者订阅关闭返回 None，SSE 用它来发心跳"""
+        try:
+            return await asyncio.wait_for(self.__anext__(), timeout)
+        except (TimeoutError, StopAsyncIteration):
+            return None
+
+
+class FanoutHub:
+    """
+    每个 worker 一个，只用一个 redis 连接 psubscribe，收到的消息按 routing key 分发给本 worker 的所有客户端
+
+    redis 的 channel 是 channel_prefix + routing key，客户端订阅的是 Worker.on 那样的 topic 模式（* 和 #）
+    第一个客户端订阅时才建立 redis 订阅，断线会自动重连
+
+    只有 broadcast / broadcast_sync 发的消息会到客户端，kombu_message.publish 发到 broker 的不会，
+    两边都要的话各调一次
+    """
+
+    def __init__(self, redis_url=None, channel_prefix=None, queue_size=None, policy=None):
+        self.redis_url = redis_url or settings.fanout_redis_url
+        self.channel_prefix = channel_prefix if channel_prefix is not None else settings.fanout_channel_prefix
+        self.queue_size = queue_size or settings.fanout_queue_size
+        self.policy = policy or settings.fanout_policy
+        self.subscriptions = set()
+        self.counters = Counter()
+        self.closing = False
+        self._task = None
+        self._redis = None
+
+    def stats(self):
+        return {"clients": len(self.subscriptions), **self.counters}
+
+    @asynccontextmanager
+    async def subscribe(self, patterns, queue_size=None, policy=None):
+        subscription = Subscription(patterns, queue_size or self.queue_size, policy or self.policy)
+        if self.closing:
+            # 服务器在关闭，新来的直接结束
+            subscription.close()
+        else:
+            self.subscriptions.add(subscription)
+            self._ensure_started()
+        try:
+            yield subscription
+        finally:
+            self.subscriptions.discard(subscription)
+            subscription.close()
+            self.counters["dropped_messages"] += subscription.dropped
+
+    def dispatch(self, routing_key, data):
+        self.counters["received"] += 1
+        for subscription in list(self.subscriptions):
+            if subscription.matches(routing_key):
+                subscription.put_nowait(routing_key, data)
+                if subscription.closed:
+                    self.counters["dropped_clients"] += 1
+                    self.subscriptions.discard(subscription)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="fanout-upstream")
+
+    async def _run(self):
+        from redis import asyncio as aioredis
+
+        backoff = 0.5
+        while True:
+            try:
+                self._redis = aioredis.from_url(self.redis_url)
+                async with self._redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.psubscribe(f"{self.channel_prefix}*")
+                    logger.info(f"fanout subscribed to {self.channel_prefix}*")
+                    backoff = 0.5
+                    async for message in pubsub.listen():
+                        self._handle(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"fanout upstream error, reconnect in {backoff}s: {e!r}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if self._redis is not None:
+                    await self._redis.aclose()
+                    self._redis = None
+
+    def _handle(self, message):
+        if message.get("type") != "pmessage":
+            return
+        channel = message["channel"]
+        channel = channel.decode() if isinstance(channel, bytes) else channel
+        try:
+            data = json.loads(message["data"])
+        except ValueError:
+            self.counters["bad_messages"] += 1
+            return
+        self.dispatch(channel.removeprefix(self.channel_prefix), data)
+
+    def close_subscriptions(self):
+        """结束所有客户端的订阅，SSE 发完积压的就结束，websocket 用 1001 关闭"""
+        self.closing = True
+        for subscription in list(self.subscriptions):
+            subscription.close()
+        self.subscriptions.clear()
+
+    async def stop(self):
+        self.close_subscriptions()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_hub = None
+
+
+def get_hub():
+    global _hub
+    if _hub is None:
+        _hub = FanoutHub()
+    return _hub
+
+
+def close_subscriptions():
+    """
+    服务器开始关闭时调用（MyServer.shutdown），uvicorn 要等所有连接断开才会执行 lifespan 的退出，
+    SSE / websocket 连接不结束的话 stop_hub 永远不会被调用
+    """
+    if _hub is not None:
+        _hub.close_subscriptions()
+
+
+async def stop_hub():
+    """在 lifespan 退出时调用"""
+    global _hub
+    if _hub is not None:
+        await _hub.stop()
+        _hub = None
+    await _close_async_clients()
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+# 每个进程复用 redis 连接池，不用每次 broadcast 都建连接；异步的连接池绑在 event loop 上，按 loop 分开
+_async_clients = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=8)
+def _sync_client(redis_url):
+    import redis
+
+    return redis.Redis.from_url(redis_url)
+
+
+def _async_client(redis_url):
+    from redis import asyncio as aioredis
+
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if redis_url not in clients:
+        clients[redis_url] = aioredis.from_url(redis_url)
+    return clients[redis_url]
+
+
+async def _close_async_clients():
+    for client in _async_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
+
+
+async def broadcast(routing_key, data, redis_url=None):
+    """发给所有 worker 上订阅了这个 routing key 的客户端，和 kombu 的消息是两条路"""
+    client = _async_client(redis_url or settings.fanout_redis_url)
+    await client.publish(f"{settings.fanout_channel_prefix}{routing_key}", _encode(data))
+
+
+def broadcast_sync(routing_key, data, redis_url=None):
+    """同步版本，kombu 消费者进程、定时任务里用"""
+    client = _sync_client(redis_url or settings.fanout_redis_url)
+    client.publish(f"{settings.fanout_channel_prefix}{routing_key}", _encode(data))
+
+
+def sse_response(patterns, hub=None, heartbeat=None, **kwargs):
+    """
+    SSE 接口直接返回它:
+
+        @app.get("/events")
+        async def events(topic: str = "user.#"):
+            return sse_response([topic])
+    """
+    hub = hub or get_hub()
+    heartbeat = heartbeat if heartbeat is not None else settings.fanout_heartbeat
+
+    async def stream():
+        async with hub.subscribe(patterns, **kwargs) as subscription:
+            while True:
+                item = await subscription.get(timeout=heartbeat)
+                if item is None:
+                    if subscription.closed:
+                        return
+                    # 注释行，防止代理把空闲的连接断掉
+                    yield ": ping\n\n"
+                    continue
+                routing_key, data = item
+                yield f"event: {routing_key}\ndata: {_encode(data)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def websocket_pump(websocket, patterns, hub=None, **kwargs):
+    """websocket 接口里 accept 以后调用，一直发到客户端断开或者因为太慢被踢掉"""
+    hub = hub or get_hub()
+    async with hub.subscribe(patterns, **kwargs) as subscription:
+        async for routing_key, data in subscription:
+            await websocket.send_json({"routing_key": routing_key, "data": data})
+        if hub.closing:
+            # 1001: going away，客户端重连到别的 worker
+            await websocket.close(code=1001)
+        elif subscription.dropped:
+            # 1013: try again later
+            await websocket.close(code=1013)
@@ -1,9 +1,15 @@
+import threading
+
 from kombu import Connection, Exchange, Queue
 from kombu.entity import PERSISTENT_DELIVERY_MODE
+from kombu.exceptions import LimitExceeded, OperationalError
 from kombu.mixins import ConsumerMixin
 from kombu.pools import producers
 
+from app.core.config import settings
 from app.core.log import logger
+from app.core.outbox import Outbox, SpoolFullError
+from app.core.timing import span
 
 connection = Connection(
     "redis://127.0.0.1:6379/3",
@@ -15,15 +21,67 @@ connection = Connection(
         "timeout": 5,
     },
 )
+# 请求路径上发消息用的连接，连不上马上失败、不重试，消息交给 outbox 落盘，重试由 outbox 的后台线程做
+publish_connection = connection.clone(
+    transport_options={
+        **connection.transport_options,
+        "max_retries": 0,
+        "socket_connect_timeout": settings.outbox_send_timeout,
+        "socket_timeout": settings.outbox_send_timeout,
+    },
+)
 exchange_name = "something"  # todo
 
 
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def _send(msg, routing_key):
+    exchange = Exchange(name=exchange_name, durable=True, type="topic", delivery_mode=PERSISTENT_DELIVERY_MODE)
+    with producers[publish_connection].acquire(block=True, timeout=settings.outbox_send_timeout) as producer:
+        producer.publish(msg, exchange=exchange, routing_key=routing_key, serializer="json")
+
+
+def _probe():
+    with publish_connection.clone() as conn:
+        conn.ensure_connection(max_retries=0)
+
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                outbox = Outbox(_send, probe=_probe)
+                outbox.start()
+                _outbox = outbox
+    return _outbox
+
+
 def publish(msg, routing_key):
     # type: (object, str) -> None
+    """
+    不会因为 broker 不可用抛异常，也不会阻塞超过 outbox_send_timeout；
+    broker 挂了并且本地文件也满了（outbox_max_bytes）时消息丢掉，只记一条 error 日志
+    只发到 broker，不会推给 SSE / websocket 客户端，要推的话再调 fanout.broadcast
+    """
     logger.info("publish {msg} {routing_key}".format(msg=msg, routing_key=routing_key))
-    exchange = Exchange(name=exchange_name, durable=True, type="topic", delivery_mode=PERSISTENT_DELIVERY_MODE)
-    with producers[connection].acquire(block=True, timeout=10) as producer:
-        producer.publish(msg, exchange=exchange, routing_key=routing_key, serializer="json")
+    outbox = get_outbox()
+    with span("kombu.publish"):
+        try:
+            # broker 挂了或者本地还有没发完的，直接写本地文件，由后台线程按顺序补发
+            if outbox.spooling:
+                outbox.append(msg, routing_key)
+                return
+            try:
+                _send(msg, routing_key)
+            except (OSError, OperationalError, LimitExceeded, *publish_connection.connection_errors) as e:
+                logger.warning(f"publish failed, spooling: {e!r}")
+                outbox.mark_unhealthy()
+                outbox.append(msg, routing_key)
+        except SpoolFullError as e:
+            logger.error(f"message to {routing_key} dropped: {e}")
 
 
 class Worker(ConsumerMixin):
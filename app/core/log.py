@@ -3,13 +3,17 @@ import datetime
 import logging
 import multiprocessing
 import os
+import queue
+import sys
+import threading
 from itertools import chain
 
 import loguru
+from loguru._file_sink import FileSink
 
 from app.core.config import settings
 
-__all__ = ["JSON_LOGS", "LOG_LEVEL", "logger"]
+__all__ = ["JSON_LOGS", "LOG_LEVEL", "BackgroundFileWriter", "logger"]
 
 logger = loguru.logger
 
@@ -108,6 +112,115 @@ class Rotator:
         return False
 
 
+class _Batch(str):
+    """一批日志拼成的字符串，带上最后一条的 record，Rotator.should_rotate 要用 message.record"""
+
+    __slots__ = ("record",)
+
+
+class BackgroundFileWriter:
+    """
+    单进程时的文件日志 sink：logger.info 只是放进队列，由单独的线程批量写文件，
+    轮转、压缩也在这个线程里做，不会卡住 event loop
+
+    overflow 是队列满了以后的处理方式:
+        block     等队列有空位，不丢日志（默认）
+        drop_new  丢掉新的日志
+        drop_old  丢掉队列里最老的日志
+    丢掉的条数会在下一批里写一行提示
+    轮转是按批判断的，文件最多会超出 rotation 的大小一批（batch_size 条）
+    logger.remove() 或者进程退出时（loguru 注册了 atexit）会调用 stop，把队列里的日志写完
+    """
+
+    def __init__(self, path, *, queue_size=None, overflow=None, batch_size=None, **file_sink_kwargs):
+        self.name = path
+        self.overflow = overflow or settings.log_overflow
+        if self.overflow not in ("block", "drop_new", "drop_old"):
+            raise ValueError(f"unknown log overflow policy {self.overflow!r}")
+        self.batch_size = batch_size or settings.log_batch_size
+        self.rotation = file_sink_kwargs.get("rotation")
+        # FileSink 是 loguru 的私有类，轮转、保留、压缩都复用它的实现，所以 loguru 在 pyproject.toml 里固定了版本
+        # delay: 第一次写的时候才创建文件
+        self._sink = FileSink(path, delay=True, **file_sink_kwargs)
+        self._queue = queue.Queue(maxsize=queue_size or settings.log_queue_size)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        if self._stopped:
+            return
+        if self.overflow == "block":
+            self._queue.put(message)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                if self.overflow == "drop_new":
+                    self._count_dropped()
+                    return
+            try:
+                oldest = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            if oldest is None:
+                # 拿到的是 stop() 放进去的结束标记，放回去，不然 stop 里的 join 永远等不到
+                self._queue.put(None)
+                self._count_dropped()
+                return
+            self._count_dropped()
+
+    def _count_dropped(self):
+        with self._dropped_lock:
+            self._dropped += 1
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            batch = [message]
+            stop = False
+            # 队列里已经有的一次取完，合成一次 write
+            while len(batch) < self.batch_size:
+                try:
+                    message = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is None:
+                    stop = True
+                    break
+                batch.append(message)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        with self._dropped_lock:
+            dropped, self._dropped = self._dropped, 0
+        text = _Batch("".join(batch))
+        if dropped:
+            text = _Batch(f"{text}... {dropped} log records dropped, log queue full\n")
+        text.record = batch[-1].record
+        try:
+            self._sink.write(text)
+        except Exception as e:
+            # 写文件出错不能让线程退出，不然后面的日志全丢
+            print(f"log writer error: {e!r}", file=sys.stderr)
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+        self._sink.stop()
+
+
 def add_file_log(log_path, _format=None, patcher=None, workers=1):
     rotator = Rotator(
         size=settings.log_rotation_size,
@@ -119,21 +232,30 @@ def add_file_log(log_path, _format=None, patcher=None, workers=1):
     else:
         spawn_context = None
         enqueue = False
+    file_options = {
+        "rotation": rotator.should_rotate,  # file size or time to rotate
+        "retention": "10 Days",  # how long a the logging data persists
+        "compression": "zip",  # log rotation compression
+    }
+    if not enqueue and settings.log_background_writer:
+        # 单进程时文件在当前进程里写，放到后台线程，不在 event loop 里做 IO
+        sink = BackgroundFileWriter(log_path, **file_options)
+        file_options = {"colorize": False}
+    else:
+        sink = log_path
     # import sys
     # logger.configure(handlers=[{"sink": sys.stdout, "serialize": JSON_LOGS, "level": LOG_LEVEL, "format": _format}], patcher=patcher)
     logger.configure(patcher=patcher)
     logger.add(
-        log_path,  # log file path
+        sink,  # log file path
         level=LOG_LEVEL,  # logging level
         format=_format,
         # format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", #format of log
         enqueue=enqueue,  # set to true for async or multiprocessing logging
         backtrace=False,  # turn to false if in production to prevent data leaking
-        rotation=rotator.should_rotate,  # file size or time to rotate
-        retention="10 Days",  # how long a the logging data persists
-        compression="zip",  # log rotation compression
         serialize=JSON_LOGS,  # if you want it JSON style, set to true. But also change the format
         context=spawn_context,
+        **file_options,
     )
 
 
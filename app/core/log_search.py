@@ -0,0 +1,276 @@
+"""
+按 request_id 查日志，包括轮转出去的 .log 和压缩的 .zip
+
+    python -m app.core.log_search <request_id>            # 增量更新索引后查询
+    python -m app.core.log_search --index-only             # 只更新索引
+    python -m app.core.log_search <request_id> --reindex   # 重建索引
+
+索引是 sqlite，放在日志旁边（logs/.app.log.idx），记录 request_id -> (文件, zip 成员, 偏移)
+当前在写的文件用 mmap 扫描，只扫上次索引之后新增的部分；压缩包流式解压，只在第一次见到时扫一遍
+文本格式（main.py 里的 time | level | request_id | message）和 JSON_LOGS 的输出都支持
+"""
+
+import argparse
+import glob
+import mmap
+import os
+import re
+import sqlite3
+import sys
+import time
+import zipfile
+
+__all__ = ["LogIndex"]
+
+# time | level | request_id | message，request_id 为 None 的不记
+TEXT_RE = re.compile(rb"^[^|\n]+ \| [A-Z]+ \| (?!None \|)([^\s|]+) \| ", re.M)
+JSON_RE = re.compile(rb'"request_id": "([^"]+)"')
+RECORD_START_RE = re.compile(rb"^(\{|[^|\n]+ \| [A-Z]+ \| )")
+HEAD_SIZE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    ino INTEGER,
+    head BLOB,
+    indexed INTEGER
+);
+CREATE TABLE IF NOT EXISTS entries (
+    request_id TEXT,
+    path TEXT,
+    member TEXT,
+    offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_request_id ON entries (request_id);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+"""
+
+
+def _iter_matches(data, start, end, json_format):
+    """返回 (request_id, 行首偏移)，同一行只返回一次；data 可以是 bytes 也可以是 mmap"""
+    if json_format:
+        last_line = -1
+        for m in JSON_RE.finditer(data, start, end):
+            line_start = data.rfind(b"\n", 0, m.start()) + 1
+            if line_start != last_line:
+                last_line = line_start
+                yield m.group(1).decode(), line_start
+    else:
+        for m in TEXT_RE.finditer(data, start, end):
+            yield m.group(1).decode(), m.start()
+
+
+class LogIndex:
+    def __init__(self, log_path, index_path=None):
+        self.log_path = os.path.abspath(log_path)
+        directory, name = os.path.split(self.log_path)
+        self.index_path = index_path or os.path.join(directory, f".{name}.idx")
+        self.db = sqlite3.connect(self.index_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def files(self):
+        """当前的日志文件加上轮转出去的，按时间排序，当前文件在最后"""
+        stem, ext = os.path.splitext(self.log_path)
+        rotated = [p for p in glob.glob(f"{stem}.*") if p != self.log_path and p.endswith((ext, ".zip"))]
+        rotated.sort(key=os.path.getmtime)
+        if os.path.exists(self.log_path):
+            rotated.append(self.log_path)
+        return rotated
+
+    def reindex(self):
+        with self.db:
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("DELETE FROM files")
+        return self.update()
+
+    def update(self):
+        """增量更新索引，返回新增的条目数"""
+        added = 0
+        existing = set(self.files())
+        with self.db:
+            # 已经被 retention 删掉的文件
+            for (path,) in self.db.execute("SELECT path FROM files").fetchall():
+                if path not in existing:
+                    self._forget(path)
+            for path in existing:
+                try:
+                    added += self._update_file(path)
+                except FileNotFoundError:
+                    # 列出来以后才被轮转或者 retention 删掉的
+                    self._forget(path)
+        return added
+
+    def _forget(self, path):
+        self.db.execute("DELETE FROM entries WHERE path = ?", (path,))
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _update_file(self, path):
+        stat = os.stat(path)
+        row = self.db.execute("SELECT size, mtime, ino, head, indexed FROM files WHERE path = ?", (path,)).fetchone()
+        with open(path, "rb") as f:
+            head = f.read(HEAD_SIZE)
+
+        if path.endswith(".zip"):
+            if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                return 0
+            self._forget(path)
+            entries = list(self._scan_zip(path))
+            indexed = stat.st_size
+        else:
+            start = 0
+            if row is not None:
+                _, _, ino, old_head, indexed = row
+                same_file = ino == stat.st_ino and stat.st_size >= indexed and head[: len(old_head)] == old_head
+                if same_file and stat.st_size == indexed:
+                    return 0
+                if same_file:
+                    start = indexed
+                else:
+                    # 文件被轮转替换了，重新扫
+                    self._forget(path)
+            entries, indexed = self._scan_plain(path, start)
+
+        self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?)", entries)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, stat.st_ino, head, indexed),
+        )
+        return len(entries)
+
+    @staticmethod
+    def _scan_plain(path, start):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return [], 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                # 只扫到最后一个完整的行，写了一半的行下次再扫
+                end = data.rfind(b"\n", start) + 1
+                if end <= start:
+                    return [], start
+                json_format = data[:1] == b"{"
+                entries = [
+                    (request_id, path, "", offset)
+                    for request_id, offset in _iter_matches(data, start, end, json_format)
+                ]
+        return entries, end
+
+    @staticmethod
+    def _scan_zip(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                offset = 0
+                json_format = None
+                with archive.open(member) as f:
+                    for line in f:
+                        if json_format is None:
+                            json_format = line.startswith(b"{")
+                        m = JSON_RE.search(line) if json_format else TEXT_RE.match(line)
+                        if m:
+                            yield m.group(1).decode(), path, member, offset
+                        offset += len(line)
+
+    def lookup(self, request_id):
+        rows = self.db.execute(
+            "SELECT path, member, offset FROM entries WHERE request_id = ?",
+            (request_id,),
+        ).fetchall()
+        order = {path: i for i, path in enumerate(self.files())}
+        rows.sort(key=lambda row: (order.get(row[0], -1), row[1], row[2]))
+        return rows
+
+    def search(self, request_id):
+        """返回这个 request_id 的所有日志（包括异常堆栈这种多行的），按时间顺序"""
+        lines = []
+        groups = {}
+        for path, member, offset in self.lookup(request_id):
+            groups.setdefault((path, member), []).append(offset)
+        for (path, member), offsets in groups.items():
+            try:
+                if member:
+                    lines.extend(self._read_zip(path, member, offsets))
+                else:
+                    lines.extend(self._read_plain(path, offsets))
+            except FileNotFoundError:
+                # 索引以后被删掉了，下次 update 时清掉
+                continue
+        return lines
+
+    @staticmethod
+    def _read_record(f):
+        record = [f.readline()]
+        while True:
+            pos = f.tell()
+            line = f.readline()
+            if not line or RECORD_START_RE.match(line):
+                f.seek(pos)
+                break
+            record.append(line)
+        return b"".join(record).decode("utf-8", "replace").rstrip("\n")
+
+    def _read_plain(self, path, offsets):
+        with open(path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield self._read_record(f)
+
+    @staticmethod
+    def _read_zip(path, member, offsets):
+        wanted = set(offsets)
+        offset = 0
+        current = None
+        with zipfile.ZipFile(path) as archive, archive.open(member) as f:
+            for line in f:
+                if current is not None:
+                    if RECORD_START_RE.match(line):
+                        yield b"".join(current).decode("utf-8", "replace").rstrip("\n")
+                        current = None
+                    else:
+                        current.append(line)
+                if offset in wanted:
+                    current = [line]
+                    wanted.discard(offset)
+                elif current is None and not wanted:
+                    break
+                offset += len(line)
+        if current is not None:
+            yield b"".join(current).decode("utf-8", "replace").rstrip("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("request_id", nargs="?")
+    parser.add_argument("--log", default="logs/app.log", help="active log file, rotated files are found next to it")
+    parser.add_argument("--index", help="index file, default .<log name>.idx next to the log")
+    parser.add_argument("--reindex", action="store_true", help="drop and rebuild the index")
+    parser.add_argument("--index-only", action="store_true", help="update the index without searching")
+    args = parser.parse_args(argv)
+    if not args.request_id and not args.index_only:
+        parser.error("request_id is required unless --index-only is given")
+
+    index = LogIndex(args.log, args.index)
+    try:
+        start = time.perf_counter()
+        added = index.reindex() if args.reindex else index.update()
+        indexed_ms = (time.perf_counter() - start) * 1000
+        if args.index_only:
+            print(f"indexed {added} new entries in {indexed_ms:.1f}ms", file=sys.stderr)
+            return 0
+
+        start = time.perf_counter()
+        lines = index.search(args.request_id)
+        for line in lines:
+            print(line)
+        search_ms = (time.perf_counter() - start) * 1000
+        print(f"{len(lines)} records, index update {indexed_ms:.1f}ms, search {search_ms:.1f}ms", file=sys.stderr)
+        return 0 if lines else 1
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
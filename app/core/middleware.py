@@ -1,9 +1,12 @@
+import time
 from contextvars import ContextVar
 from uuid import uuid4
 
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app.core import timing
+from app.core.config import settings
 from app.core.log import logger
 
 REQUEST_ID_CTX_KEY = "request_id"
@@ -12,27 +15,61 @@ _request_id_ctx_var: ContextVar[str] = ContextVar(REQUEST_ID_CTX_KEY, default=No
 #
 
 
-class RequestContextLogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
-        request_id = _request_id_ctx_var.set(str(uuid4()))
-        # print('set id is', id(_request_id_ctx_var))
+class RequestContextLogMiddleware:
+    """
+    设置 request_id，并在请求结束时写一行访问日志
+    client "method path" status bytes duration，request_id 由 patch_log 带上
+    uvicorn 自己的 access log 在 MyConfig 里关掉了，避免每个请求多走一遍标准库 logging
 
-        logger.info(
-            "request received (in middleware)",
-            method=request.method,
-            path=request.url.path,
-            client=request.client and request.client.host,
-            ua=request.headers.get("User-Agent"),
-        )
+    同时收集 app.core.timing 里的 span，响应头里带上 Server-Timing，
+    超过 settings.slow_request_ms 的请求把 span 树打到日志里
+    """
 
-        response = await call_next(request)
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-        logger.info("request finished (in middleware)")
-        response.headers["X-Request-ID"] = get_request_id()
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        _request_id_ctx_var.reset(request_id)
+        request_id = str(uuid4())
+        token = _request_id_ctx_var.set(request_id)
+        spans_token = timing.start_request()
+        start = time.perf_counter()
+        status = 500
+        sent = 0
 
-        return response
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                if settings.server_timing_enabled:
+                    total_ms = (time.perf_counter() - start) * 1000
+                    headers.append("Server-Timing", timing.server_timing(timing.current_spans(), total_ms))
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            client = scope.get("client")
+            duration_ms = (time.perf_counter() - start) * 1000
+            # 不传参数，loguru 就不会对消息做 format，path 里带 {} 也没问题
+            logger.info(
+                f'{client[0] if client else "-"} "{scope["method"]} {scope["path"]}" '
+                f"{status} {sent}B {duration_ms:.2f}ms"
+            )
+            if duration_ms > settings.slow_request_ms:
+                logger.warning(
+                    f'slow request "{scope["method"]} {scope["path"]}" {duration_ms:.2f}ms\n'
+                    f"{timing.format_tree(timing.current_spans())}"
+                )
+            timing.end_request(spans_token)
+            _request_id_ctx_var.reset(token)
 
 
 def get_request_id() -> str:
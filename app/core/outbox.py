@@ -0,0 +1,282 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+from app.core.config import settings
+from app.core.log import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ["Outbox", "SpoolFullError"]
+
+# 每条记录: 长度 + crc32 + json
+RECORD_HEADER = struct.Struct("<II")
+OFFSET = struct.Struct("<Q")
+MAX_SPOOL_FILES = 64
+
+
+class SpoolFullError(Exception):
+    pass
+
+
+class Outbox:
+    """
+    broker 不可用时的本地落盘队列
+
+    - send(msg, routing_key) 失败以后调用 mark_unhealthy()，之后的消息都 append 到本地文件，不再等 broker
+    - 文件是只追加的，fsync 由后台线程按 fsync_interval 批量做，append 不会等磁盘
+    - 后台线程每 retry_interval 试一次把文件里的消息按顺序重放，全部发完才恢复直接发送，
+      所以在文件清空之前新的消息也要进文件，保证顺序
+    - 重放到哪里记在 .offset 文件里，进程崩溃重启后接着发，消息至少发送一次
+    - 每个进程用 flock 占一个文件（outbox-0.spool、outbox-1.spool ...），
+      进程挂掉留下的文件会被下一个启动的进程接管
+    - 有 probe 时后台线程每 probe_interval 秒检查一次 broker，挂了就提前切到落盘，
+      请求不用先等一次发送超时才发现
+    - 一条消息重放失败 max_attempts 次、而 probe 说 broker 是好的，认为是这条消息本身有问题，
+      移到 .dead 文件，不再挡住后面的消息；没有 probe 时分不清，一直重试
+    """
+
+    def __init__(
+        self,
+        send,
+        directory=None,
+        max_bytes=None,
+        fsync_interval=None,
+        retry_interval=None,
+        probe=None,
+        probe_interval=None,
+        max_attempts=None,
+    ):
+        self.send = send
+        self.probe = probe
+        self.directory = directory or settings.outbox_dir
+        self.max_bytes = max_bytes if max_bytes is not None else settings.outbox_max_bytes
+        self.fsync_interval = fsync_interval if fsync_interval is not None else settings.outbox_fsync_interval
+        self.retry_interval = retry_interval if retry_interval is not None else settings.outbox_retry_interval
+        self.probe_interval = probe_interval if probe_interval is not None else settings.outbox_probe_interval
+        self.max_attempts = max_attempts if max_attempts is not None else settings.outbox_max_attempts
+        self.path = None
+        self.healthy = True
+        self.counters = Counter()
+        self._fd = None
+        self._size = 0
+        self._read_offset = 0
+        self._attempts = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def spooling(self):
+        return not self.healthy or self._size > self._read_offset
+
+    def pending_bytes(self):
+        return self._size - self._read_offset
+
+    def stats(self):
+        return {"healthy": self.healthy, "pending_bytes": self.pending_bytes(), **self.counters}
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._claim()
+        self._read_offset = self._load_offset()
+        self._size = self._recover()
+        if self.pending_bytes():
+            # 上次没发完的
+            logger.warning(f"outbox {self.path} has {self.pending_bytes()} bytes pending, replaying")
+            self.healthy = False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-drainer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            with self._lock:
+                self._sync()
+                # 关闭文件同时释放 flock
+                os.close(self._fd)
+                self._fd = None
+
+    def _claim(self):
+        if fcntl is None:  # pragma: no cover
+            self.path = os.path.join(self.directory, f"outbox-{os.getpid()}.spool")
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            return
+        for i in range(MAX_SPOOL_FILES):
+            path = os.path.join(self.directory, f"outbox-{i}.spool")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self.path = path
+            self._fd = fd
+            return
+        raise RuntimeError(f"no free outbox spool file in {self.directory}")
+
+    def _load_offset(self):
+        try:
+            with open(f"{self.path}.offset", "rb") as f:
+                return OFFSET.unpack(f.read(OFFSET.size))[0]
+        except (OSError, struct.error):
+            return 0
+
+    def _save_offset(self):
+        tmp = f"{self.path}.offset.tmp"
+        with open(tmp, "wb") as f:
+            f.write(OFFSET.pack(self._read_offset))
+        os.replace(tmp, f"{self.path}.offset")
+
+    def _recover(self):
+        """找到最后一条完整的记录，后面写了一半的截掉"""
+        size = os.fstat(self._fd).st_size
+        if self._read_offset > size:
+            self._read_offset = 0
+        offset = self._read_offset
+        while offset < size:
+            record = self._read_record(offset)
+            if record is None:
+                logger.warning(f"outbox {self.path} truncated at {offset}, dropping {size - offset} bytes")
+                os.ftruncate(self._fd, offset)
+                break
+            offset = record[1]
+        return offset
+
+    def _read_record(self, offset):
+        """返回 (payload, 下一条的偏移)，不完整或者校验失败返回 None"""
+        header = os.pread(self._fd, RECORD_HEADER.size, offset)
+        if len(header) < RECORD_HEADER.size:
+            return None
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = os.pread(self._fd, length, offset + RECORD_HEADER.size)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return None
+        return payload, offset + RECORD_HEADER.size + length
+
+    def mark_unhealthy(self):
+        if self.healthy:
+            logger.warning("broker unavailable, spooling messages to local outbox")
+        self.healthy = False
+
+    def append(self, msg, routing_key):
+        payload = json.dumps({"msg": msg, "routing_key": routing_key}, ensure_ascii=False).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._size + len(record) > self.max_bytes:
+                self.counters["dropped"] += 1
+                raise SpoolFullError(f"outbox {self.path} is full ({self.max_bytes} bytes)")
+            os.write(self._fd, record)
+            self._size += len(record)
+            self._dirty = True
+        self.counters["spooled"] += 1
+
+    def _sync(self):
+        if self._dirty and self._fd is not None:
+            os.fsync(self._fd)
+            self._dirty = False
+
+    def drain(self):
+        """按顺序重放，返回发出去的条数；发送失败就停下，等下次重试，一条失败太多次移到 .dead"""
+        sent = 0
+        start_offset = self._read_offset
+        try:
+            while self._read_offset < self._size:
+                record = self._read_record(self._read_offset)
+                if record is None:
+                    break
+                payload, next_offset = record
+                data = json.loads(payload)
+                try:
+                    self.send(data["msg"], data["routing_key"])
+                except Exception as e:
+                    self.healthy = False
+                    # broker 是好的才算这条消息的问题，broker 挂了的时候等多久都不丢
+                    if self.probe is not None and self._probe():
+                        self._attempts += 1
+                    if self._attempts < self.max_attempts:
+                        logger.warning(f"outbox replay failed, retry in {self.retry_interval}s: {e!r}")
+                        return sent
+                    self._dead_letter(payload, e)
+                else:
+                    sent += 1
+                    self.counters["replayed"] += 1
+                self._read_offset = next_offset
+                self._attempts = 0
+        finally:
+            if self._read_offset != start_offset:
+                self._save_offset()
+
+        # 一条都没发出去（比如全进了 .dead）时不能说明 broker 是好的，要再 probe 一次；不在锁里做，不挡 append
+        recovered = self.healthy or sent or self._probe_ok()
+        with self._lock:
+            # 加锁再看一次，期间可能又有新消息写进来
+            if self._read_offset >= self._size:
+                os.ftruncate(self._fd, 0)
+                self._size = self._read_offset = 0
+                self._dirty = False
+                self._save_offset()
+                if recovered:
+                    self._mark_healthy()
+        return sent
+
+    def _mark_healthy(self):
+        if not self.healthy:
+            logger.info("outbox drained, publishing directly again")
+        self.healthy = True
+
+    def _probe_ok(self):
+        # 没有 probe 时只能乐观地认为 broker 好了，下一次直接发送失败会再切回落盘
+        return self.probe is None or self._probe()
+
+    def _dead_letter(self, payload, error):
+        logger.error(
+            f"outbox giving up on a record after {self._attempts} attempts, moved to {self.path}.dead: {error!r}"
+        )
+        with open(f"{self.path}.dead", "ab") as f:
+            f.write(payload + b"\n")
+        self.counters["dead_lettered"] += 1
+
+    def _probe(self):
+        try:
+            self.probe()
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"broker probe failed: {e!r}")
+            return False
+        return True
+
+    def _run(self):
+        last_drain = last_probe = 0.0
+        while not self._stop.is_set():
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            with self._lock:
+                self._sync()
+            now = time.monotonic()
+            if self.spooling:
+                if now - last_drain >= self.retry_interval:
+                    last_drain = now
+                    if self.pending_bytes():
+                        self.drain()
+                    elif self._probe_ok():
+                        # 文件是空的，只是被 probe 或者发送失败标记成了不可用
+                        self._mark_healthy()
+            elif self.probe is not None and now - last_probe >= self.probe_interval:
+                last_probe = now
+                if not self._probe():
+                    self.mark_unhealthy()
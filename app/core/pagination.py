@@ -0,0 +1,131 @@
+import base64
+import binascii
+import json
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select, tuple_
+
+from app.core.config import settings
+
+__all__ = ["InvalidCursor", "count_rows", "decode_cursor", "encode_cursor", "keyset_page"]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _keys(order_by):
+    return [column.key for column in order_by]
+
+
+def encode_cursor(order_by, values):
+    """游标对前端是不透明的，里面是排序列的名字和上一页最后一行的值"""
+    payload = json.dumps({"k": _keys(order_by), "v": jsonable_encoder(values)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(order_by, cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        keys, values = payload["k"], payload["v"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor("invalid cursor") from e
+    if keys != _keys(order_by) or not isinstance(values, list) or len(values) != len(order_by):
+        # 换了排序方式，旧的游标不能用
+        raise InvalidCursor("cursor does not match the sort order")
+    try:
+        # 日期之类的在 json 里是字符串，转回列的 python 类型
+        return [_coerce(column, value) for column, value in zip(order_by, values, strict=True)]
+    except (ValueError, TypeError) as e:
+        # 被改过的游标，值和列的类型对不上
+        raise InvalidCursor("invalid cursor") from e
+
+
+def _coerce(column, value):
+    if value is None:
+        return None
+    if isinstance(value, (list, dict)):
+        # encode_cursor 只会写标量
+        raise TypeError(f"unexpected cursor value for {column.key}")
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if isinstance(value, python_type):
+        return value
+    fromisoformat = getattr(python_type, "fromisoformat", None)
+    if fromisoformat is not None and isinstance(value, str):
+        return fromisoformat(value)
+    return python_type(value)
+
+
+def _is_entity_select(statement):
+    # select(User) 返回 ORM 对象，select(User.id, User.name) 返回行
+    descriptions = statement.column_descriptions
+    if len(descriptions) != 1:
+        return False
+    entity = descriptions[0]["entity"]
+    return entity is not None and descriptions[0]["expr"] is entity
+
+
+def count_rows(session, statement, estimate=False):
+    """
+    返回 (总数, 是否估算)
+
+    estimate 时在 PostgreSQL 上用 EXPLAIN 的行数估计，不用扫全表，翻页的成本和第一页一样；
+    其他数据库没有便宜的估算方式，还是 count(*)
+    """
+    statement = statement.order_by(None)
+    bind = session.get_bind()
+    if estimate and bind.dialect.name == "postgresql":
+        compiled = statement.compile(dialect=bind.dialect)
+        plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+    return session.execute(select(func.count()).select_from(statement.subquery())).scalar_one(), False
+
+
+def keyset_page(session, statement, order_by, limit=20, cursor=None, descending=False, total=None, serialize=None):
+    """
+    keyset（seek）分页: WHERE (排序列) > (上一页最后一行的值) ORDER BY 排序列 LIMIT n，
+    走索引直接定位，不像 OFFSET 那样越往后越慢
+
+    order_by: 排序列，最后一列必须唯一（一般是主键），比如 [User.created_at, User.id]，要有对应的联合索引
+    total: None 不返回总数，"exact" count(*)，"estimate" 估算（见 count_rows）
+    serialize: 每行转成可 json 化对象的函数，select(User) 这种返回 ORM 对象的要传
+
+    session 是同步的 Session，在 async handler 里用 run_in_threadpool 调用
+    返回 {"items": [...], "next_cursor": ..., "total": ..., "total_estimated": ...}
+    """
+    limit = max(1, min(limit, settings.pagination_max_limit))
+    page = statement
+    if cursor:
+        values = decode_cursor(order_by, cursor)
+        row_key = tuple_(*order_by)
+        page = page.where(row_key < tuple_(*values) if descending else row_key > tuple_(*values))
+    page = page.order_by(*(column.desc() if descending else column.asc() for column in order_by)).limit(limit + 1)
+
+    result = session.execute(page)
+    if _is_entity_select(statement):
+        rows = result.scalars().all()
+        keys = [(lambda row, key=key: getattr(row, key)) for key in _keys(order_by)]
+    else:
+        rows = result.mappings().all()
+        keys = [(lambda row, key=key: row[key]) for key in _keys(order_by)]
+
+    # 多取一行用来判断还有没有下一页
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(order_by, [key(rows[-1]) for key in keys])
+
+    data = {
+        "items": [serialize(row) if serialize else dict(row) if hasattr(row, "keys") else row for row in rows],
+        "next_cursor": next_cursor,
+        "total": None,
+        "total_estimated": False,
+    }
+    if total is not None:
+        data["total"], data["total_estimated"] = count_rows(session, statement, estimate=total == "estimate")
+    return data
@@ -0,0 +1,101 @@
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from app.core.config import settings
+from app.core.log import logger
+
+__all__ = ["install_signal_handler", "profiler"]
+
+
+def collapse_stack(frame, thread_name):
+    """把一个线程的调用栈转成 flamegraph 的 collapsed 格式: thread;outer;...;inner"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    names.reverse()
+    return ";".join(name.replace(";", ":") for name in names)
+
+
+class SamplingProfiler:
+    """
+    采样 profiler，用 sys._current_frames 定时抓所有线程的栈，结果写成 collapsed stack 文件
+    可以直接丢给 flamegraph.pl / speedscope
+
+    平时没有任何开销，只有 start 之后才起一个采样线程；同一个 worker 同时只能有一个在跑
+    """
+
+    def __init__(self):
+        self._busy = threading.Lock()
+
+    @property
+    def running(self):
+        return self._busy.locked()
+
+    def start(self, duration=None, rate=None, output_dir=None):
+        """开始采样，已经在跑的话返回 False"""
+        if not self._busy.acquire(blocking=False):
+            return False
+        args = (
+            duration or settings.profiler_duration,
+            rate or settings.profiler_rate,
+            output_dir or settings.profiler_dir,
+        )
+        threading.Thread(target=self._run, args=args, name="sampling-profiler", daemon=True).start()
+        return True
+
+    def _run(self, duration, rate, output_dir):
+        try:
+            logger.info(f"profiler started, {duration}s at {rate}Hz")
+            counts = self.sample(duration, rate)
+            path = self.write(counts, output_dir)
+            logger.info(f"profiler finished, {sum(counts.values())} samples written to {path}")
+        except Exception:
+            logger.exception("profiler failed")
+        finally:
+            self._busy.release()
+
+    @staticmethod
+    def sample(duration, rate):
+        counts = Counter()
+        interval = 1.0 / rate
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    counts[collapse_stack(frame, names.get(ident, f"thread-{ident}"))] += 1
+            time.sleep(interval)
+        return counts
+
+    @staticmethod
+    def write(counts, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+profiler = SamplingProfiler()
+
+
+def install_signal_handler():
+    """
+    收到 SIGUSR2 时开始采样，在每个 worker 里由 MyConfig.configure_logging 调用
+        kill -USR2 <worker pid>
+    windows 没有 SIGUSR2，不安装
+    """
+    signum = getattr(signal, "SIGUSR2", None)
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signum, lambda *_: profiler.start())
+    return True
@@ -0,0 +1,241 @@
+import itertools
+import json
+import math
+import time
+from collections import Counter
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.log import logger
+
+__all__ = ["MemoryBackend", "RateLimitMiddleware", "RedisBackend", "create_backend", "get_stats"]
+
+# 每个 worker 的计数，allowed / rejected 以及按 bucket 区分的 rejected:client、rejected:/api 等
+_stats = Counter()
+
+# 令牌桶，KEYS[1] 是 bucket，ARGV: rate(每秒), capacity, 本次想要拿的令牌数
+# 用 redis 的 TIME，避免各 worker 之间时钟不一致；返回 {拿到的令牌数, 需要等待的秒数}
+TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+local wait = 0
+if granted == 0 then
+    wait = (1 - tokens) / rate
+end
+return {granted, tostring(wait)}
+"""
+
+
+def get_stats():
+    return dict(_stats)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now):
+        """拿一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class MemoryBackend:
+    """进程内的令牌桶，单 worker 或者测试时用，也是 redis 不可用时的兜底"""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    async def acquire(self, key, rate, capacity):
+        return self.acquire_nowait(key, rate, capacity)
+
+    def acquire_nowait(self, key, rate, capacity):
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._evict(now)
+            bucket = self._buckets[key] = TokenBucket(rate, capacity, now)
+        return bucket.take(now)
+
+    def _evict(self, now):
+        # 已经回满的桶和新建的没有区别，直接丢掉
+        for key, bucket in list(self._buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.capacity:
+                del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            self._buckets.clear()
+
+
+class RedisBackend:
+    """
+    redis 上的令牌桶，所有 worker 共享
+
+    为了避免每个请求一次 redis 往返，每次从 redis 批量拿 lease 个令牌放在本地消费，
+    本地用完或者过期（lease_ttl 秒）才再去 redis 拿；redis 出错时退化成本地的令牌桶，
+    并且 cooldown 秒内不再访问 redis，避免 redis 挂掉时每个请求都等一次超时
+    本地的 lease 和兜底的令牌桶一样最多 max_keys 个，大量不同 IP 的请求不会让内存一直涨
+    """
+
+    def __init__(self, url, lease=5, lease_ttl=1.0, prefix="ratelimit:", timeout=None, cooldown=None, max_keys=100_000):
+        from redis import asyncio as aioredis
+
+        timeout = timeout if timeout is not None else settings.rate_limit_redis_timeout
+        self.redis = aioredis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.script = self.redis.register_script(TOKEN_BUCKET_LUA)
+        self.lease = lease
+        self.lease_ttl = lease_ttl
+        self.prefix = prefix
+        self.cooldown = cooldown if cooldown is not None else settings.rate_limit_redis_cooldown
+        self.max_keys = max_keys
+        self._leases = {}
+        self._fallback = MemoryBackend(max_keys=max_keys)
+        self._last_error = 0.0
+        self._skip_until = 0.0
+
+    async def acquire(self, key, rate, capacity):
+        now = time.monotonic()
+        tokens, expires = self._leases.get(key, (0, 0.0))
+        if tokens > 0 and now < expires:
+            self._leases[key] = (tokens - 1, expires)
+            return 0.0
+
+        if now < self._skip_until:
+            return self._fallback.acquire_nowait(key, rate, capacity)
+        try:
+            granted, wait = await self.script(keys=[self.prefix + key], args=[rate, capacity, self.lease])
+        except Exception as e:
+            self._skip_until = now + self.cooldown
+            if now - self._last_error > 10:
+                self._last_error = now
+                logger.warning(f"rate limit redis unavailable, fallback to local buckets for {self.cooldown}s: {e}")
+            return self._fallback.acquire_nowait(key, rate, capacity)
+
+        granted = int(granted)
+        if granted == 0:
+            self._leases.pop(key, None)
+            return float(wait)
+        self._store_lease(key, granted - 1, now + self.lease_ttl, now)
+        return 0.0
+
+    def _store_lease(self, key, tokens, expires, now):
+        # 先删再插，dict 的顺序就是从 redis 拿 lease 的先后
+        self._leases.pop(key, None)
+        if len(self._leases) >= self.max_keys:
+            self._evict(now)
+        self._leases[key] = (tokens, expires)
+
+    def _evict(self, now):
+        # 过期的 lease 下次也要去 redis 拿，和没有一样
+        for key, (_, expires) in list(self._leases.items()):
+            if expires <= now:
+                del self._leases[key]
+        # 还是满的就丢最早拿的，丢掉的只是本地还没用完的几个令牌
+        for key in list(itertools.islice(self._leases, max(0, len(self._leases) - self.max_keys + 1))):
+            del self._leases[key]
+
+
+def create_backend():
+    if settings.rate_limit_redis_url:
+        return RedisBackend(settings.rate_limit_redis_url, lease=settings.rate_limit_lease)
+    return MemoryBackend()
+
+
+class RateLimitMiddleware:
+    """
+    路由之前按客户端、按路由限流，超出的请求直接返回 429，不进入后面的中间件和 handler
+
+    routes: {路径前缀: (rate, burst)}，命中的请求除了客户端的桶以外还要过这个路由的桶
+    exempt: 不限流的路径前缀
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend=None,
+        rate=None,
+        burst=None,
+        routes=None,
+        exempt=(),
+        key_func=None,
+    ):
+        self.app = app
+        self.backend = backend if backend is not None else create_backend()
+        self.rate = rate if rate is not None else settings.rate_limit_rate
+        self.burst = burst if burst is not None else settings.rate_limit_burst
+        # 长的前缀优先匹配
+        self.routes = sorted((routes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.exempt = tuple(exempt)
+        self.key_func = key_func or self.client_key
+
+    @staticmethod
+    def client_key(scope: Scope):
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if self.exempt and path.startswith(self.exempt):
+            await self.app(scope, receive, send)
+            return
+
+        client = self.key_func(scope)
+        retry_after = await self.backend.acquire(f"c:{client}", self.rate, self.burst)
+        bucket = "client"
+        if not retry_after:
+            for prefix, (rate, burst) in self.routes:
+                if path.startswith(prefix):
+                    retry_after = await self.backend.acquire(f"r:{prefix}:{client}", rate, burst)
+                    bucket = prefix
+                    break
+
+        if retry_after:
+            _stats["rejected"] += 1
+            _stats[f"rejected:{bucket}"] += 1
+            await self.reject(send, retry_after)
+            return
+
+        _stats["allowed"] += 1
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def reject(send: Send, retry_after):
+        body = json.dumps({"detail": "Too Many Requests"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
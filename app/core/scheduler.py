@@ -0,0 +1,124 @@
+import functools
+import os
+import threading
+import time
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+from pid import PidFile, PidFileError
+
+from app.core.config import settings
+from app.core.log import logger
+
+__all__ = ["scheduled_job", "shutdown_scheduler", "start_scheduler"]
+
+# 通过 scheduled_job 注册的任务，模块导入时收集，真正添加到 scheduler 要等选上 leader 以后
+_jobs = []
+
+_lock = threading.Lock()
+_scheduler = None
+_pidfile = None
+_standby = None
+_stop_event = threading.Event()
+
+
+def scheduled_job(trigger, **trigger_args):
+    """
+    注册定时任务，用法和 apscheduler 的 scheduled_job 一样::
+
+        @scheduled_job("interval", minutes=5)
+        def cleanup(): ...
+
+    多 worker 部署时只有 leader 进程会执行，任务耗时写到日志里
+    """
+
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                logger.exception(f"job {name} failed after {(time.perf_counter() - start) * 1000:.1f}ms")
+                raise
+            logger.info(f"job {name} finished in {(time.perf_counter() - start) * 1000:.1f}ms")
+            return result
+
+        _jobs.append((wrapper, trigger, {"id": name, "name": name, "replace_existing": True, **trigger_args}))
+        return func
+
+    return decorator
+
+
+def _try_lead():
+    """用 pid 文件 + flock 抢 leader，抢到返回 True；进程退出时锁由系统释放，其他进程就能接替"""
+    global _pidfile, _scheduler
+    # 不能指望别的地方（比如文件日志）先把目录建好
+    os.makedirs(settings.scheduler_lock_dir, exist_ok=True)
+    pidfile = PidFile(
+        pidname=settings.scheduler_lock_name,
+        piddir=settings.scheduler_lock_dir,
+        register_term_signal_handler=False,
+        register_atexit=False,
+    )
+    try:
+        pidfile.create()
+    except PidFileError:
+        return False
+
+    scheduler = BackgroundScheduler(
+        executors={"default": ThreadPoolExecutor(max_workers=settings.scheduler_max_workers)},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 60},
+    )
+    for func, trigger, kwargs in _jobs:
+        scheduler.add_job(func, trigger, **kwargs)
+    scheduler.start()
+    _pidfile, _scheduler = pidfile, scheduler
+    logger.info(f"scheduler started in process {os.getpid()} with {len(_jobs)} jobs")
+    return True
+
+
+def _standby_loop():
+    # 没抢到锁的进程定期重试，leader 进程挂掉以后由它接替
+    while not _stop_event.wait(settings.scheduler_failover_interval):
+        with _lock:
+            if _try_lead():
+                return
+
+
+def start_scheduler():
+    """
+    在当前进程尝试启动 scheduler，保证整个部署里只有一个进程在跑定时任务
+
+    父进程（supervisor）先调用时由父进程持有锁；否则由第一个启动的 worker 持有，
+    其余 worker 进入 standby，leader 死掉后接替
+    返回当前进程是否是 leader
+    """
+    global _standby
+    with _lock:
+        if _scheduler is not None:
+            return True
+        _stop_event.clear()
+        if _try_lead():
+            return True
+        if _standby is None or not _standby.is_alive():
+            _standby = threading.Thread(target=_standby_loop, name="scheduler-standby", daemon=True)
+            _standby.start()
+    return False
+
+
+def shutdown_scheduler(wait=True):
+    global _scheduler, _pidfile, _standby
+    _stop_event.set()
+    with _lock:
+        if _scheduler is not None:
+            _scheduler.shutdown(wait=wait)
+            _scheduler = None
+        if _pidfile is not None:
+            _pidfile.close()
+            _pidfile = None
+    if _standby is not None:
+        _standby.join(timeout=1)
+        _standby = None
@@ -1,9 +1,11 @@
 import logging
 import sys
 
-from uvicorn import Config
+from uvicorn import Config, Server
 
+from app.core.fanout import close_subscriptions
 from app.core.log import logger, setup_logging
+from app.core.profiler import install_signal_handler
 
 
 class MyConfig(Config):
@@ -19,6 +21,8 @@ class MyConfig(Config):
         """
         # 这里core.handlers 里只有文件的handler
         self.handlers = logger._core.handlers
+        # 访问日志由 RequestContextLogMiddleware 直接写一行，uvicorn 自带的 access log 关掉
+        kwargs.setdefault("access_log", False)
         super().__init__(*args, **kwargs)
 
     def configure_logging(self) -> None:
@@ -46,3 +50,18 @@ class MyConfig(Config):
             logger.add(sys.stderr, level=logging.INFO)
 
             setup_logging()
+        # setup_logging 会把 uvicorn.access 重新接到 InterceptHandler 上，这里再关一次
+        logging.getLogger("uvicorn.access").disabled = not self.access_log
+        # 每个 worker 都能 kill -USR2 <pid> 抓一段 profile，写到 logs/ 下
+        install_signal_handler()
+
+
+class MyServer(Server):
+    """
+    uvicorn 关闭时先停止接受新连接，再等已有的连接都结束，最后才执行 lifespan 的退出；
+    SSE / websocket 这种长连接自己不会结束，这里在开始关闭时先把它们的订阅关掉
+    """
+
+    async def shutdown(self, sockets=None):
+        close_subscriptions()
+        await super().shutdown(sockets=sockets)
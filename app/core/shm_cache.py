@@ -0,0 +1,267 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # windows 上没有 fcntl，只能保证同一个进程内的写是互斥的
+    fcntl = None
+
+__all__ = ["SharedCache", "create_cache", "destroy_cache", "get_cache"]
+
+ENV_NAME = "SHM_CACHE_NAME"
+MAGIC = b"SKV1"
+
+# magic, buckets, ways, key_size, value_size
+HEADER = struct.Struct("<4sIHHI")
+HEADER_SIZE = 64
+# 每个 bucket 前面 4 字节是 CLOCK 的指针
+BUCKET_HEAD = struct.Struct("<I")
+# seq, used, ref, key_len, value_len, expires, key_hash
+SLOT = struct.Struct("<IBBHIdQ")
+SLOT_HEAD_SIZE = 32
+SEQ = struct.Struct("<I")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _hash(key):
+    # 不能用 hash()，每个进程的随机种子不一样
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class SharedCache:
+    """
+    多个 worker 共享的定长哈希表，放在 multiprocessing.shared_memory 里，key / value 都是 bytes
+
+    - 组相联: 每个 key 只会落在一个 bucket 的 ways 个槽位里，找不到空位时用 CLOCK 淘汰
+    - 读不加锁，每个槽位有一个 seqlock 计数，写的时候是奇数，读到奇数或者前后不一致就重读
+    - 写用 flock 做跨进程互斥
+    - 父进程 create 以后把名字放到环境变量里，spawn 出来的 worker 用 get_cache() attach
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        magic, self.buckets, self.ways, self.key_size, self.value_size = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"shared memory {shm.name} is not a cache")
+        self.slot_size = SLOT_HEAD_SIZE + self.key_size + self.value_size
+        self.bucket_size = BUCKET_HEAD.size + self.ways * self.slot_size
+        self._thread_lock = threading.Lock()
+        self._lock_file = None
+        if fcntl is not None:
+            self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{shm.name.lstrip('/')}.lock"), "a+")
+
+    @staticmethod
+    def size_for(buckets, ways, key_size, value_size):
+        return HEADER_SIZE + buckets * (BUCKET_HEAD.size + ways * (SLOT_HEAD_SIZE + key_size + value_size))
+
+    @classmethod
+    def create(cls, name=None, buckets=None, ways=None, key_size=None, value_size=None):
+        buckets = buckets or settings.shm_cache_buckets
+        ways = ways or settings.shm_cache_ways
+        key_size = key_size or settings.shm_cache_key_size
+        value_size = value_size or settings.shm_cache_value_size
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size_for(buckets, ways, key_size, value_size))
+        # 新建的共享内存都是 0，就是所有槽位都是空的
+        HEADER.pack_into(shm.buf, 0, MAGIC, buckets, ways, key_size, value_size)
+        os.environ[ENV_NAME] = shm.name
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            # 3.13 以后可以不注册到 resource_tracker，避免 worker 退出时把共享内存删掉
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    def unlink(self):
+        self.shm.unlink()
+        if self._lock_file is not None:
+            try:
+                os.remove(self._lock_file.name)
+            except OSError:
+                pass
+
+    def _slot_offset(self, bucket, way):
+        return HEADER_SIZE + bucket * self.bucket_size + BUCKET_HEAD.size + way * self.slot_size
+
+    def _read_slot(self, offset):
+        """seqlock 读，返回 (key, value, expires, key_hash)，空槽位或者一直读不到一致的数据返回 None"""
+        buf = self.buf
+        for _ in range(100):
+            seq, used, _, key_len, value_len, expires, key_hash = SLOT.unpack_from(buf, offset)
+            if seq & 1:
+                continue
+            if not used:
+                return None
+            data_offset = offset + SLOT_HEAD_SIZE
+            key = bytes(buf[data_offset : data_offset + key_len])
+            value_offset = data_offset + self.key_size
+            value = bytes(buf[value_offset : value_offset + value_len])
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return key, value, expires, key_hash
+        return None
+
+    def get(self, key, default=None):
+        key_hash = _hash(key)
+        bucket = key_hash % self.buckets
+        now = time.time()
+        for way in range(self.ways):
+            offset = self._slot_offset(bucket, way)
+            # 先只看 hash，不一样的槽位不用拷贝数据
+            if SLOT.unpack_from(self.buf, offset)[6] != key_hash:
+                continue
+            slot = self._read_slot(offset)
+            if slot is None or slot[0] != key:
+                continue
+            _, value, expires, _ = slot
+            if expires and expires < now:
+                return default
+            # CLOCK 的引用位，不加锁，丢了也没关系
+            self.buf[offset + 5] = 1
+            return value
+        return default
+
+    def set(self, key, value, ttl=None):
+        if len(key) > self.key_size or len(value) > self.value_size:
+            raise ValueError(f"key/value too large, limit {self.key_size}/{self.value_size} bytes")
+        key_hash = _hash(key)
+        bucket = key_hash % self.buckets
+        expires = time.time() + ttl if ttl else 0.0
+        with self._locked():
+            way = self._find_way(bucket, key, key_hash)
+            self._write_slot(self._slot_offset(bucket, way), key, value, expires, key_hash)
+
+    def delete(self, key):
+        key_hash = _hash(key)
+        bucket = key_hash % self.buckets
+        with self._locked():
+            for way in range(self.ways):
+                offset = self._slot_offset(bucket, way)
+                slot = self._read_slot(offset)
+                if slot is not None and slot[0] == key:
+                    self._clear_slot(offset)
+                    return True
+        return False
+
+    def _find_way(self, bucket, key, key_hash):
+        now = time.time()
+        free = None
+        for way in range(self.ways):
+            offset = self._slot_offset(bucket, way)
+            slot = self._read_slot(offset)
+            if slot is None:
+                free = way if free is None else free
+            elif slot[3] == key_hash and slot[0] == key:
+                return way
+            elif free is None and slot[2] and slot[2] < now:
+                free = way
+        if free is not None:
+            return free
+        return self._clock_evict(bucket)
+
+    def _clock_evict(self, bucket):
+        head = HEADER_SIZE + bucket * self.bucket_size
+        hand = BUCKET_HEAD.unpack_from(self.buf, head)[0] % self.ways
+        while True:
+            ref_offset = self._slot_offset(bucket, hand) + 5
+            if self.buf[ref_offset]:
+                self.buf[ref_offset] = 0
+                hand = (hand + 1) % self.ways
+                continue
+            BUCKET_HEAD.pack_into(self.buf, head, (hand + 1) % self.ways)
+            return hand
+
+    def _begin_write(self, offset):
+        seq = SEQ.unpack_from(self.buf, offset)[0]
+        # 写的进程中途挂掉会留下奇数，这里直接在它的基础上继续
+        seq = (seq + 1) | 1
+        SEQ.pack_into(self.buf, offset, seq & 0xFFFFFFFF)
+        return seq
+
+    def _write_slot(self, offset, key, value, expires, key_hash):
+        seq = self._begin_write(offset)
+        data_offset = offset + SLOT_HEAD_SIZE
+        self.buf[data_offset : data_offset + len(key)] = key
+        value_offset = data_offset + self.key_size
+        self.buf[value_offset : value_offset + len(value)] = value
+        SLOT.pack_into(self.buf, offset, seq, 1, 0, len(key), len(value), expires, key_hash)
+        SEQ.pack_into(self.buf, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def _clear_slot(self, offset):
+        seq = self._begin_write(offset)
+        SLOT.pack_into(self.buf, offset, seq, 0, 0, 0, 0, 0.0, 0)
+        SEQ.pack_into(self.buf, offset, (seq + 1) & 0xFFFFFFFF)
+
+    def _locked(self):
+        return _WriteLock(self._thread_lock, self._lock_file)
+
+
+class _WriteLock:
+    __slots__ = ("file", "lock")
+
+    def __init__(self, lock, file):
+        self.lock = lock
+        self.file = file
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.lock.release()
+
+
+def create_cache():
+    """父进程里调用，在启动 worker 之前"""
+    global _cache
+    with _cache_lock:
+        _cache = SharedCache.create()
+    return _cache
+
+
+def get_cache():
+    """worker 里调用，第一次调用时按环境变量里的名字 attach；没有启用返回 None"""
+    global _cache
+    if _cache is None:
+        name = os.environ.get(ENV_NAME)
+        if not name:
+            return None
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedCache.attach(name)
+    return _cache
+
+
+def destroy_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            owner = _cache.owner
+            _cache.close()
+            if owner:
+                _cache.unlink()
+                os.environ.pop(ENV_NAME, None)
+            _cache = None
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from itertools import islice
+from typing import Any
+
+import anyio
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.core.log import logger
+
+__all__ = ["RowStreamResponse", "server_side_rows"]
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def server_side_rows(session, statement, yield_per=1000):
+    """用服务端游标执行查询，逐行返回 mapping，而不是一次性 fetchall
+
+    session 可以是 SQLAlchemy 的 Session 或 Connection，生成器被关闭时游标随之关闭
+    """
+    result = session.execute(statement.execution_options(stream_results=True, yield_per=yield_per))
+    try:
+        yield from result.mappings()
+    finally:
+        result.close()
+
+
+async def _iterate_sync(rows: Iterable, batch_size: int) -> AsyncIterator:
+    # 同步的迭代器（比如数据库游标）会阻塞，放到线程池里取，每次取一批，减少线程切换的次数
+    iterator = iter(rows)
+    try:
+        while True:
+            batch = await run_in_threadpool(list, islice(iterator, batch_size))
+            if not batch:
+                break
+            for row in batch:
+                yield row
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            # 断开时外层的 cancel scope 已经被取消，不屏蔽的话这个 await 会马上被取消，游标就没关掉
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(close)
+
+
+async def _iterate_async(rows: AsyncIterable) -> AsyncIterator:
+    try:
+        async for row in rows:
+            yield row
+    finally:
+        # 异步生成器用 aclose，SQLAlchemy 的 AsyncResult 用 close
+        close = getattr(rows, "aclose", None) or getattr(rows, "close", None)
+        if close is not None:
+            await close()
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(jsonable_encoder(obj), ensure_ascii=False, separators=(",", ":"))
+
+
+class RowStreamResponse(StreamingResponse):
+    """
+    流式返回大结果集，行从异步生成器或服务端游标里逐批取出，边取边编码
+
+    fmt:
+        json    保持 {"code": .., "msg": .., "data": [...]} 的外层结构，data 逐行输出
+        ndjson  每行一个 json
+        csv     第一行是表头，fieldnames 不传则取第一行数据的 key
+    客户端断开以后 starlette 会取消发送任务，这里负责把生成器/游标关掉，提前结束查询
+    """
+
+    def __init__(
+        self,
+        rows: Iterable | AsyncIterable,
+        fmt: str = "json",
+        code: int = 0,
+        msg: str = "",
+        fieldnames: list[str] | None = None,
+        filename: str | None = None,
+        batch_size: int = 500,
+        chunk_size: int = 64 * 1024,
+        **kwargs,
+    ):
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"unsupported stream format: {fmt}")
+        self.fmt = fmt
+        self.code = code
+        self.msg = msg
+        self.fieldnames = fieldnames
+        self.chunk_size = chunk_size
+        self.rows_sent = 0
+        if isinstance(rows, AsyncIterable):
+            self._rows = _iterate_async(rows)
+        else:
+            self._rows = _iterate_sync(rows, batch_size)
+
+        headers = kwargs.pop("headers", None) or {}
+        if filename:
+            headers.setdefault("Content-Disposition", f'attachment; filename="{filename}"')
+        super().__init__(self._encode(), headers=headers, media_type=MEDIA_TYPES[fmt], **kwargs)
+
+    async def _encode(self) -> AsyncIterator[bytes]:
+        # 攒够 chunk_size 再发，避免每行一次 send
+        buffer = []
+        size = 0
+        for piece in self._head():
+            buffer.append(piece)
+        async for row in self._rows:
+            piece = self._encode_row(row)
+            buffer.append(piece)
+            size += len(piece)
+            self.rows_sent += 1
+            if size >= self.chunk_size:
+                yield "".join(buffer).encode("utf-8")
+                buffer.clear()
+                size = 0
+        buffer.append(self._tail())
+        yield "".join(buffer).encode("utf-8")
+
+    def _head(self) -> list[str]:
+        if self.fmt == "json":
+            return [f'{{"code":{_dumps(self.code)},"msg":{_dumps(self.msg)},"data":[']
+        if self.fmt == "csv" and self.fieldnames:
+            return [self._csv_line(self.fieldnames)]
+        return []
+
+    def _tail(self) -> str:
+        if self.fmt == "json":
+            return "]}"
+        return ""
+
+    def _encode_row(self, row) -> str:
+        if self.fmt == "json":
+            return ("," if self.rows_sent else "") + _dumps(row)
+        if self.fmt == "ndjson":
+            return _dumps(row) + "\n"
+        row = jsonable_encoder(row)
+        if self.fieldnames is None:
+            self.fieldnames = list(row)
+            return self._csv_line(self.fieldnames) + self._csv_line([row.get(k) for k in self.fieldnames])
+        if isinstance(row, dict):
+            row = [row.get(k) for k in self.fieldnames]
+        return self._csv_line(row)
+
+    @staticmethod
+    def _csv_line(values) -> str:
+        out = io.StringIO()
+        csv.writer(out).writerow(values)
+        return out.getvalue()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 正常结束时生成器已经耗尽，aclose 是空操作；断开时这里会关掉游标，停止查询
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+                await self._rows.aclose()
+            logger.info(f"stream response finished, fmt={self.fmt} rows={self.rows_sent}")
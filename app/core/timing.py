@@ -0,0 +1,166 @@
+import functools
+import inspect
+import re
+import time
+from contextvars import ContextVar
+
+from starlette.concurrency import run_in_threadpool
+
+__all__ = ["instrument_engine", "span", "timed_threadpool"]
+
+# 当前请求里记录的 span，由 RequestContextLogMiddleware 在请求开始时设置，请求之外为 None，span 什么都不做
+_spans_ctx_var: ContextVar[list | None] = ContextVar("spans", default=None)
+_parent_ctx_var: ContextVar["Span | None"] = ContextVar("span_parent", default=None)
+
+_TOKEN_RE = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+class Span:
+    __slots__ = ("end", "name", "parent", "start")
+
+    def __init__(self, name, start, parent=None, end=None):
+        self.name = name
+        self.start = start
+        self.parent = parent
+        self.end = end
+
+    @property
+    def duration_ms(self):
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+
+class span:
+    """
+    记录一段代码的耗时，可以当 with / async with 用，也可以当装饰器::
+
+        with span("kombu.publish"):
+            ...
+
+        @span("dep")
+        async def dep(): ...
+
+    嵌套的 span 会记下父子关系，慢请求日志里按树打印
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        spans = _spans_ctx_var.get()
+        if spans is not None:
+            self._span = Span(self.name, time.perf_counter(), _parent_ctx_var.get())
+            spans.append(self._span)
+            self._token = _parent_ctx_var.set(self._span)
+        return self
+
+    def __exit__(self, *exc):
+        if self._span is not None:
+            self._span.end = time.perf_counter()
+            _parent_ctx_var.reset(self._token)
+            self._span = self._token = None
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+    def __call__(self, func):
+        name = self.name
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+async def timed_threadpool(func, *args, **kwargs):
+    """
+    和 run_in_threadpool 一样，额外记录两个 span:
+    <name>.wait 在线程池里排队的时间，<name> 真正执行的时间
+    """
+    spans = _spans_ctx_var.get()
+    if spans is None:
+        return await run_in_threadpool(func, *args, **kwargs)
+
+    name = getattr(func, "__name__", "threadpool")
+    submitted = time.perf_counter()
+
+    def run():
+        # 线程池里的 context 是复制过来的，spans 是同一个 list
+        spans.append(Span(f"{name}.wait", submitted, _parent_ctx_var.get(), time.perf_counter()))
+        with span(name):
+            return func(*args, **kwargs)
+
+    return await run_in_threadpool(run)
+
+
+def instrument_engine(engine):
+    """给 SQLAlchemy engine 加上 db span，每条语句一个"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        timer = span("db")
+        timer.__enter__()
+        conn.info.setdefault("_spans", []).append(timer)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        timers = conn.info.get("_spans")
+        if timers:
+            timers.pop().__exit__(None, None, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        timers = conn.info.get("_spans") if conn is not None else None
+        if timers:
+            timers.pop().__exit__(None, None, None)
+
+    return engine
+
+
+def start_request():
+    return _spans_ctx_var.set([])
+
+
+def end_request(token):
+    _spans_ctx_var.reset(token)
+
+
+def current_spans():
+    return _spans_ctx_var.get() or []
+
+
+def server_timing(spans, total_ms):
+    """Server-Timing 头，同名的 span 耗时累加，只算已经结束的"""
+    durations = {}
+    for item in spans:
+        if item.end is not None:
+            name = _TOKEN_RE.sub("_", item.name)
+            durations[name] = durations.get(name, 0.0) + item.duration_ms
+    parts = [f"{name};dur={dur:.2f}" for name, dur in durations.items()]
+    parts.append(f"total;dur={total_ms:.2f}")
+    return ", ".join(parts)
+
+
+def format_tree(spans):
+    depth = {}
+    lines = []
+    for item in spans:
+        level = depth[id(item)] = depth.get(id(item.parent), -1) + 1 if item.parent is not None else 0
+        lines.append(f"{'  ' * (level + 1)}{item.name} {item.duration_ms:.2f}ms")
+    return "\n".join(lines)
@@ -1,9 +1,13 @@
 import inspect
 from typing import Any, Callable
 
-from fastapi import Depends
+from fastapi import Depends, Request
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 
+from app.core.conditional import conditional_response, not_modified
+from app.core.pagination import InvalidCursor, keyset_page
+from app.core.streaming import RowStreamResponse
 from app.http_tool import CODE_ERROR, CODE_SUCCESS
 from app.schemas.common import CommonResponse
 
@@ -71,3 +75,34 @@ class BaseView(object):
     @classmethod
     def error_response(cls, msg, data=None, code=CODE_ERROR):
         return cls.common_response(code, msg, data)
+
+    @classmethod
+    def stream_response(cls, msg, rows, fmt="json", code=CODE_SUCCESS, **kwargs):
+        """大结果集用这个，rows 可以是异步生成器或 server_side_rows 返回的游标，不会一次性读进内存"""
+        return RowStreamResponse(rows, fmt=fmt, code=code, msg=msg, **kwargs)
+
+    @classmethod
+    def conditional_response(cls, request: Request, msg, data=None, code=CODE_SUCCESS, version=None):
+        """
+        带 ETag 的响应，前端轮询的接口用这个，内容没变时返回 304
+        version 不传时对序列化后的 body 做 hash
+        """
+        return conditional_response(request, cls.common_response(code, msg, data), version=version)
+
+    @classmethod
+    def not_modified(cls, request: Request, version):
+        """version 没变时返回 304 响应，handler 直接 return 它，不用再查数据；变了返回 None"""
+        return not_modified(request, version)
+
+    @classmethod
+    def paginate(cls, msg, session, statement, order_by, limit=20, cursor=None, code=CODE_SUCCESS, **kwargs):
+        """
+        keyset 分页，data 是 {"items", "next_cursor", "total", "total_estimated"}，参数见 keyset_page
+        前端把 next_cursor 原样带回来取下一页，为 None 时没有下一页；游标无效（被改过、换了排序）时返回 400
+        """
+        try:
+            data = keyset_page(session, statement, order_by, limit=limit, cursor=cursor, **kwargs)
+        except InvalidCursor as e:
+            # 游标是前端原样传回来的，解不开就是请求本身有问题
+            return JSONResponse(cls.error_response(str(e)), status_code=400)
+        return cls.common_response(code, msg, data)
@@ -0,0 +1,133 @@
+import asyncio
+import bisect
+import json
+import sys
+import threading
+import time
+import traceback
+
+from app.core.config import settings
+from app.core.log import logger
+from app.core.middleware import _request_id_ctx_var
+
+__all__ = ["LoopWatchdog", "lag_histogram", "start_watchdog", "stop_watchdog"]
+
+# 直方图的桶上界，单位 ms，最后一个桶是 +Inf
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LagHistogram:
+    def __init__(self, buckets=LAG_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, lag_ms):
+        self.counts[bisect.bisect_left(self.buckets, lag_ms)] += 1
+        self.count += 1
+        self.sum += lag_ms
+        self.max = max(self.max, lag_ms)
+
+    def snapshot(self):
+        # prometheus 风格的累计计数
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip((*self.buckets, "+Inf"), self.counts, strict=True):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3), "max": round(self.max, 3)}
+
+
+class LoopWatchdog:
+    """
+    在单独的线程里定时往 event loop 丢一个回调，看它多久才被执行，就是 loop 的延迟
+
+    延迟超过 threshold 时，loop 线程多半被同步调用卡住了（比如 async def 里直接 time.sleep），
+    这时抓 loop 线程当前的调用栈，连同正在跑的 task 的 request_id 一起写日志；
+    另外每隔 report_interval 秒把延迟直方图写一行日志
+    """
+
+    def __init__(self, loop, interval=None, threshold_ms=None, report_interval=None):
+        self.loop = loop
+        self.interval = interval if interval is not None else settings.loop_watchdog_interval
+        self.threshold_ms = threshold_ms if threshold_ms is not None else settings.loop_lag_threshold_ms
+        self.report_interval = report_interval if report_interval is not None else settings.loop_lag_report_interval
+        self.histogram = LagHistogram()
+        self._loop_thread = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # 要在 loop 线程里调用，记下 loop 线程的 id，卡住时才知道抓哪个线程的栈
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + self.threshold_ms / 1000 + 1)
+            self._thread = None
+
+    def _run(self):
+        last_report = time.monotonic()
+        while not self._stop.wait(self.interval):
+            beat = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self.loop.call_soon_threadsafe(beat.set)
+            except RuntimeError:
+                # loop 已经关了
+                return
+            if not beat.wait(self.threshold_ms / 1000):
+                self.report_blocked((time.perf_counter() - sent) * 1000)
+                while not beat.wait(self.interval) and not self._stop.is_set():
+                    pass
+            self.histogram.observe((time.perf_counter() - sent) * 1000)
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                self.report_lag()
+
+    def report_lag(self):
+        # 累计值，和 lag_histogram() 返回的一样，两次相减就是这段时间的分布
+        logger.info(f"event loop lag ms: {json.dumps(self.histogram.snapshot(), separators=(',', ':'))}")
+
+    def report_blocked(self, lag_ms):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>\n"
+        request_id = None
+        task = asyncio.current_task(self.loop)
+        if task is not None:
+            request_id = task.get_context().get(_request_id_ctx_var)
+        # 在 watchdog 线程自己的 context 里设置 request_id，日志里的 request_id 列就是被卡住的那个请求
+        token = _request_id_ctx_var.set(request_id)
+        try:
+            logger.warning(f"event loop blocked for more than {lag_ms:.0f}ms, loop thread stack:\n{stack.rstrip()}")
+        finally:
+            _request_id_ctx_var.reset(token)
+
+
+_watchdog = None
+
+
+def start_watchdog():
+    """在 lifespan 里调用，每个 worker 一个"""
+    global _watchdog
+    if _watchdog is None and settings.loop_watchdog_enabled:
+        _watchdog = LoopWatchdog(asyncio.get_running_loop())
+        _watchdog.start()
+    return _watchdog
+
+
+def stop_watchdog():
+    global _watchdog
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
+
+
+def lag_histogram():
+    return _watchdog.histogram.snapshot() if _watchdog is not None else None
@@ -0,0 +1,277 @@
+"""
+HTTP 压测，对比不同 worker 数、文件日志开关、JSON_LOGS 开关下的 RPS 和延迟
+
+    uv run benchmarks/http_bench.py --workers 1,2,N --duration 10 --output bench.json
+    uv run benchmarks/http_bench.py --compare bench.json --output new.json
+
+subprocess 模式下每个组合都会起一个 `main.py --workers W` 进程；
+inprocess 模式直接在当前进程的线程里跑 main:app（只有 1 个 worker，日志配置用当前进程的），适合配合 profiler 用
+--compare 会和保存的基线对比，RPS 下降或者 p99 上升超过 --threshold 就算回归，退出码为 1
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, "frontend", "dist", "_bench")
+STATIC_PATH = "/_bench/bench.js"
+
+
+class BenchServer:
+    def __init__(self, port, workers=1, file_log=True, json_logs=False, inprocess=False):
+        self.port = port
+        self.workers = workers
+        self.file_log = file_log
+        self.json_logs = json_logs
+        self.inprocess = inprocess
+        self._proc = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self.inprocess:
+            sys.path.insert(0, ROOT)
+            from uvicorn import Config, Server
+
+            from main import app
+
+            self._server = Server(Config(app, host="127.0.0.1", port=self.port, access_log=False))
+            self._thread = threading.Thread(target=self._server.run, daemon=True)
+            self._thread.start()
+        else:
+            cmd = [sys.executable, "main.py", "--workers", str(self.workers), "--port", str(self.port)]
+            if not self.file_log:
+                cmd.append("--no-file-log")
+            env = dict(os.environ, JSON_LOGS="1" if self.json_logs else "0")
+            self._proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._wait_ready()
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._proc is not None and self._proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {self._proc.returncode}")
+            try:
+                status, _ = asyncio.run(_single_get("127.0.0.1", self.port, "/foo"))
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("server did not become ready")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+        if self._proc is not None:
+            self._proc.send_signal(signal.SIGINT)
+            try:
+                self._proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                self._proc.wait()
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def _single_get(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        return await _read_response(reader), None
+    finally:
+        writer.close()
+
+
+async def _connection_loop(host, port, path, deadline, latencies, errors):
+    # 一个 keep-alive 连接顺序发请求；不用 httpx，客户端自己的开销越小越好
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode()
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[0] += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors[0] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def drive(host, port, path, duration, concurrency):
+    latencies = []
+    errors = [0]
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(_connection_loop(host, port, path, deadline, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def prepare_static():
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    with open(os.path.join(STATIC_DIR, "bench.js"), "w") as f:
+        f.write("// benchmark payload\n" + "console.log('bench');\n" * 800)
+
+
+def cleanup_static():
+    try:
+        os.remove(os.path.join(STATIC_DIR, "bench.js"))
+        os.rmdir(STATIC_DIR)
+    except OSError:
+        pass
+
+
+def parse_workers(value):
+    workers = []
+    for item in value.split(","):
+        item = item.strip()
+        workers.append(os.cpu_count() or 1 if item.upper() == "N" else int(item))
+    return sorted(set(workers))
+
+
+def result_key(result):
+    return (result["workers"], result["file_log"], result["json_logs"], result["path"])
+
+
+def compare(baseline, current, threshold):
+    """返回回归列表：RPS 下降超过 threshold，或者 p99 上升超过 threshold"""
+    base = {result_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = base.get(result_key(result))
+        if old is None:
+            continue
+        if old["rps"] and result["rps"] < old["rps"] * (1 - threshold):
+            regressions.append((result, "rps", old["rps"], result["rps"]))
+        if old["p99_ms"] and result["p99_ms"] > old["p99_ms"] * (1 + threshold):
+            regressions.append((result, "p99_ms", old["p99_ms"], result["p99_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["subprocess", "inprocess"], default="subprocess")
+    parser.add_argument("--workers", default="1,2,N", help="comma separated, N means cpu count")
+    parser.add_argument("--file-log", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--json-logs", choices=["on", "off", "both"], default="both")
+    parser.add_argument("--paths", default=f"/foo,/,{STATIC_PATH}")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per path")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--output", default="bench_http.json")
+    parser.add_argument("--compare", help="baseline json produced by a previous run")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    switch = {"on": [True], "off": [False], "both": [True, False]}
+    if args.mode == "inprocess":
+        matrix = [(1, None, None)]
+    else:
+        matrix = list(itertools.product(parse_workers(args.workers), switch[args.file_log], switch[args.json_logs]))
+    paths = [p for p in args.paths.split(",") if p]
+
+    prepare_static()
+    results = []
+    try:
+        for workers, file_log, json_logs in matrix:
+            server = BenchServer(
+                args.port,
+                workers=workers,
+                file_log=file_log,
+                json_logs=json_logs,
+                inprocess=args.mode == "inprocess",
+            )
+            server.start()
+            try:
+                for path in paths:
+                    stats = asyncio.run(drive("127.0.0.1", args.port, path, args.duration, args.concurrency))
+                    result = {"workers": workers, "file_log": file_log, "json_logs": json_logs, "path": path, **stats}
+                    results.append(result)
+                    print(
+                        f"workers={workers} file_log={file_log} json_logs={json_logs} {path:<20} "
+                        f"rps={stats['rps']:>10} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                        f"p99={stats['p99_ms']}ms errors={stats['errors']}"
+                    )
+            finally:
+                server.stop()
+    finally:
+        cleanup_static()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": args.mode,
+            "duration": args.duration,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        for result, metric, old, new in regressions:
+            print(f"REGRESSION {result_key(result)} {metric}: {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+单条日志的开销，用和 main.py 一样的 add_file_log 配置
+
+    uv run benchmarks/log_bench.py --records 20000 --output bench_log.json
+
+每个 case 报告:
+    ns/record            调用方看到的平均耗时
+    peak_bytes/record    单次调用期间的临时内存峰值 (tracemalloc)
+    retained_blocks/record  调用后没有释放的内存块，正常应该接近 0
+CPython 不提供分配次数的计数，所以这里不报 allocations/record，用上面两个内存指标代替
+enqueue 和 background 的 case 额外报告 drain_ns/record，即包括后台线程写完文件的总耗时
+direct 是直接写文件的 FileSink（settings.log_background_writer=False），background 是单进程默认的 BackgroundFileWriter
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import log as log_module
+from app.core.config import settings
+from app.core.log import InterceptHandler, Rotator, add_file_log, logger, setup_logging
+from app.core.middleware import _request_id_ctx_var, patch_log
+
+# 和 main.py 里的保持一致
+FORMAT = "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {extra[request_id]} | {message}"
+MESSAGE = "message from foo hanlder"
+
+
+def measure(func, records, warmup=200):
+    for _ in range(warmup):
+        func()
+
+    start = time.perf_counter_ns()
+    for _ in range(records):
+        func()
+    elapsed = time.perf_counter_ns() - start
+
+    # 内存单独测一遍，tracemalloc 本身很慢，不能和计时混在一起
+    samples = min(records, 500)
+    tracemalloc.start()
+    peak_total = 0
+    before_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        peak_total += max(0, tracemalloc.get_traced_memory()[1] - current)
+    after_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    return {
+        "ns/record": round(elapsed / records, 1),
+        "peak_bytes/record": round(peak_total / samples, 1),
+        "retained_blocks/record": round((after_blocks - before_blocks) / samples, 3),
+    }
+
+
+@contextlib.contextmanager
+def file_sink(tmpdir, workers=1, json_logs=False, background=True):
+    logger.remove()
+    path = os.path.join(tmpdir, f"app-{workers}-{int(json_logs)}-{int(background)}.log")
+    with (
+        mock.patch.object(log_module, "JSON_LOGS", json_logs),
+        mock.patch.object(settings, "log_background_writer", background),
+    ):
+        add_file_log(path, _format=FORMAT, patcher=patch_log, workers=workers)
+    try:
+        yield path
+    finally:
+        logger.remove()
+
+
+def bench_loguru(tmpdir, records, workers, json_logs, background=False):
+    with file_sink(tmpdir, workers=workers, json_logs=json_logs, background=background):
+        result = measure(lambda: logger.info(MESSAGE), records)
+        if workers > 1 or background:
+            # enqueue / background 模式调用方只是把消息放进队列，这里再测一下包括落盘的总耗时
+            start = time.perf_counter_ns()
+            for _ in range(records):
+                logger.info(MESSAGE)
+            if background:
+                # BackgroundFileWriter 没有 flush，remove 时 stop 会等队列写完
+                logger.remove()
+            else:
+                logger.complete()
+            result["drain_ns/record"] = round((time.perf_counter_ns() - start) / records, 1)
+    return result
+
+
+def bench_intercept(tmpdir, records):
+    with file_sink(tmpdir):
+        setup_logging()
+        std_logger = logging.getLogger("uvicorn.error")
+        result = measure(lambda: std_logger.info(MESSAGE), records)
+    logging.root.handlers = []
+    return result
+
+
+def bench_intercept_emit_only(records):
+    # 只看 InterceptHandler 自己查找调用栈的开销，不写文件
+    logger.remove()
+    handler = InterceptHandler()
+    record = logging.LogRecord("uvicorn.error", logging.INFO, __file__, 1, MESSAGE, (), None)
+    return measure(lambda: handler.emit(record), records)
+
+
+def bench_patch_log(records):
+    record = {"extra": {}}
+    return measure(lambda: patch_log(record), records)
+
+
+class _Message(str):
+    __slots__ = ("record",)
+
+
+def bench_rotator(tmpdir, records):
+    rotator = Rotator(size=10**12, at=datetime.datetime.strptime("00:00", "%H:%M"))
+    message = _Message(f"2022-06-16 at 16:07:51 | INFO | None | {MESSAGE}\n")
+    message.record = {"time": datetime.datetime.now()}
+    with open(os.path.join(tmpdir, "rotate.log"), "a") as f:
+        f.write(message)
+        return measure(lambda: rotator.should_rotate(message, f), records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--output", help="write results as json")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="log_bench_")
+    token = _request_id_ctx_var.set("1e6d2857-fcfe-4f39-913a-470fa7f694d4")
+    cases = {}
+    try:
+        cases["patch_log"] = bench_patch_log(args.records)
+        cases["rotator.should_rotate"] = bench_rotator(tmpdir, args.records)
+        cases["intercept_handler.emit (no sink)"] = bench_intercept_emit_only(args.records)
+        cases["logger.info text direct"] = bench_loguru(tmpdir, args.records, workers=1, json_logs=False)
+        cases["logger.info json direct"] = bench_loguru(tmpdir, args.records, workers=1, json_logs=True)
+        cases["logger.info text background"] = bench_loguru(
+            tmpdir, args.records, workers=1, json_logs=False, background=True
+        )
+        cases["logger.info json background"] = bench_loguru(
+            tmpdir, args.records, workers=1, json_logs=True, background=True
+        )
+        cases["logger.info text enqueue"] = bench_loguru(tmpdir, args.records, workers=2, json_logs=False)
+        cases["logger.info json enqueue"] = bench_loguru(tmpdir, args.records, workers=2, json_logs=True)
+        cases["stdlib -> intercept -> file"] = bench_intercept(tmpdir, args.records)
+    finally:
+        _request_id_ctx_var.reset(token)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    width = max(len(name) for name in cases)
+    for name, result in cases.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{k}={v}" for k, v in result.items()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"records": args.records, "cases": cases}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,47 @@
 import argparse
 import os
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import Depends, FastAPI
 from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
-from starlette.concurrency import run_in_threadpool
 from starlette.types import Scope
-from uvicorn import Server
 from uvicorn.supervisors import Multiprocess
 
+from app.core.admission import AdmissionControlMiddleware
+from app.core.admission import get_stats as admission_stats
+from app.core.compression import CompressionMiddleware
+from app.core.config import settings
+from app.core.consumers import ConsumerSupervisor, load_consumer_modules
+from app.core.fanout import stop_hub
 from app.core.log import add_file_log, logger
 from app.core.middleware import RequestContextLogMiddleware, patch_log
-from app.core.server_config import MyConfig
+from app.core.ratelimit import RateLimitMiddleware
+from app.core.ratelimit import get_stats as rate_limit_stats
+from app.core.scheduler import shutdown_scheduler, start_scheduler
+from app.core.server_config import MyConfig, MyServer
+from app.core.shm_cache import create_cache, destroy_cache
+from app.core.timing import span, timed_threadpool
+from app.core.watchdog import lag_histogram, start_watchdog, stop_watchdog
 
-app = FastAPI()
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # 多 worker 时父进程已经先拿到了 scheduler 的锁，这里的 worker 只做 standby
+    start_scheduler()
+    start_watchdog()
+    yield
+    # SSE / websocket 的订阅是第一次用到时才建立的
+    await stop_hub()
+    stop_watchdog()
+    shutdown_scheduler()
 
+
+app = FastAPI(lifespan=lifespan)
+
+
+@span("dep")
 async def dep():
     logger.info("dep start")
     return "foo"
@@ -30,7 +55,7 @@ def test_func():
 @app.get("/")
 async def root(value: str = Depends(dep)):
     logger.info("message from root hanlder")
-    await run_in_threadpool(test_func)
+    await timed_threadpool(test_func)
     return {"message": value}
 
 
@@ -40,6 +65,26 @@ async def foo():
     return {"message": "Hello World"}
 
 
+@app.get("/health")
+async def health():
+    # 不受并发上限限制，过载时也能看到这个 worker 的排队、拒绝和 loop 延迟
+    return {
+        "status": "ok",
+        "admission": admission_stats(),
+        "rate_limit": rate_limit_stats(),
+        "loop_lag": lag_histogram(),
+    }
+
+
+# 最后添加的在最外层
+# 压缩在日志中间件里面，访问日志里记的是压缩后的字节数
+app.add_middleware(CompressionMiddleware)
+# 并发上限，过载时排队或者直接 503
+app.add_middleware(AdmissionControlMiddleware)
+if settings.rate_limit_enabled:
+    # 被限流的请求不会排队、也不会走到路由
+    app.add_middleware(RateLimitMiddleware)
+# 日志在最外层，503 / 429 也有访问日志和 X-Request-ID
 app.add_middleware(RequestContextLogMiddleware)
 
 # todo add cors middleware
@@ -90,9 +135,14 @@ if __name__ == "__main__":
     parser.add_argument("--workers", type=int, default=1, help="Number of workers")
     # 添加port参数,默认端口为8000
     parser.add_argument("--port", type=int, default=8000, help="Port number")
+    # 消费者进程数，和 http worker 一起由这个进程管理
+    parser.add_argument("--consumers", type=int, default=0, help="Number of kombu consumer processes")
+    # 关掉文件日志，压测时对比日志的开销用
+    parser.add_argument("--no-file-log", action="store_true", help="Disable logs/app.log")
     # 解析命令行参数
     args = parser.parse_args()
     workers = args.workers
+    consumers = args.consumers
     port = args.port
 
     # 配置日志
@@ -102,20 +152,44 @@ if __name__ == "__main__":
     # # 添加文件 sink
     _format = "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {extra[request_id]} | {message}"
     # 文件日志，由父进程处理，避免多个进程同时写入文件导致的文件损坏
-    add_file_log("logs/app.log", _format=_format, patcher=patch_log, workers=workers)
+    if not args.no_file_log:
+        # 有消费者进程时也是多进程写，要走父进程的队列
+        add_file_log("logs/app.log", _format=_format, patcher=patch_log, workers=workers + consumers)
+
+    supervisor = None
+    if consumers > 0:
+        bindings = load_consumer_modules()
+        if bindings:
+            # 和 MyConfig 一样，这时 handlers 里只有文件日志，可以传给子进程
+            supervisor = ConsumerSupervisor(consumers, bindings, logger._core.handlers)
+        else:
+            logger.warning("--consumers given but no @consumer registered, check settings.consumer_modules")
+
+    # 共享内存缓存在启动 worker 之前创建，名字通过环境变量传给 spawn 出来的 worker
+    if settings.shm_cache_enabled:
+        create_cache()
 
     try:
+        if supervisor is not None:
+            supervisor.start()
         # 根据workers数量选择启动模式
         if workers < 2:
             # 单进程模式
             config = MyConfig(app, host="0.0.0.0", workers=workers, port=port)
-            server = Server(config=config)
+            server = MyServer(config=config)
             server.run()
         else:
             # 多进程模式
             config = MyConfig("main:app", host="0.0.0.0", workers=workers, port=port)
-            server = Server(config=config)
+            server = MyServer(config=config)
+            # 定时任务放在父进程里跑，避免每个 worker 都执行一遍
+            start_scheduler()
             sock = config.bind_socket()
             Multiprocess(config, target=server.run, sockets=[sock]).run()
     except KeyboardInterrupt:
         pass  # pragma: full coverage
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+        shutdown_scheduler()
+        destroy_cache()
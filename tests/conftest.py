@@ -0,0 +1,24 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def make_client():
+    """
+    用几个 GET 接口和一个中间件拼一个测试用的 app:
+
+        client = make_client({"/foo": foo}, RateLimitMiddleware, rate=1, burst=1)
+
+    routes 是 {path: endpoint}；middleware 的参数直接跟在后面
+    """
+
+    def factory(routes, middleware=None, /, raise_server_exceptions=True, **middleware_kwargs):
+        app = FastAPI()
+        for path, endpoint in routes.items():
+            app.get(path)(endpoint)
+        if middleware is not None:
+            app.add_middleware(middleware, **middleware_kwargs)
+        return TestClient(app, raise_server_exceptions=raise_server_exceptions)
+
+    return factory
@@ -0,0 +1,170 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.core.admission import (
+    PRIORITY_CRITICAL,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    AdmissionControlMiddleware,
+    AdmissionController,
+)
+
+
+def test_classify():
+    priorities = (("/health", PRIORITY_CRITICAL), ("/api/export", PRIORITY_LOW))
+    middleware = AdmissionControlMiddleware(None, max_concurrency=1, priorities=priorities)
+    assert middleware.classify("/health") == PRIORITY_CRITICAL
+    assert middleware.classify("/_next/static/app.js") == PRIORITY_CRITICAL
+    assert middleware.classify("/api/export/users") == PRIORITY_LOW
+    assert middleware.classify("/foo") == PRIORITY_NORMAL
+
+
+def test_queue_timeout_and_queue_full():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, queue_size=1, queue_timeout=0.05)
+        assert await controller.acquire() is True
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+        assert await controller.acquire() is False  # queue full
+        assert await waiter is False  # timed out
+        controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["shed_queue_full"] == 1
+    assert stats["shed_timeout"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+
+
+def test_priority_order_and_critical_bypass():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, queue_size=10, queue_timeout=1)
+        order = []
+        assert await controller.acquire() is True
+
+        async def request(name, priority):
+            assert await controller.acquire(priority)
+            order.append(name)
+            controller.release(priority)
+
+        low = asyncio.create_task(request("low", PRIORITY_LOW))
+        await asyncio.sleep(0)
+        normal = asyncio.create_task(request("normal", PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        # 健康检查不排队
+        assert await controller.acquire(PRIORITY_CRITICAL) is True
+        controller.release(PRIORITY_CRITICAL)
+        assert order == []
+
+        controller.release()
+        await asyncio.gather(low, normal)
+        return order
+
+    assert asyncio.run(run()) == ["normal", "low"]
+
+
+def test_reserved_slots_not_used_by_low_priority():
+    async def run():
+        controller = AdmissionController(max_concurrency=2, queue_size=10, queue_timeout=0.05, reserved=1)
+        assert await controller.acquire(PRIORITY_LOW) is True
+        assert await controller.acquire(PRIORITY_LOW) is False
+        assert await controller.acquire(PRIORITY_NORMAL) is True
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, queue_size=10, queue_timeout=1)
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_middleware_returns_503_with_retry_after():
+    app = FastAPI()
+
+    @app.get("/slow")
+    async def slow():
+        await asyncio.sleep(0.3)
+        return {"message": "slow"}
+
+    @app.get("/health")
+    async def health():
+        return {"message": "ok"}
+
+    app.add_middleware(AdmissionControlMiddleware, max_concurrency=1, queue_size=0, queue_timeout=0.01)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(client.get("/slow"))
+            await asyncio.sleep(0.05)
+            second = await client.get("/slow")
+            third = await client.get("/health")
+            return await first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first.status_code == 200
+    assert second.status_code == 503
+    assert second.headers["retry-after"] == "1"
+    assert third.status_code == 200
+
+
+def test_exempt_paths_and_sse_do_not_hold_slots():
+    app = FastAPI()
+
+    @app.get("/export")
+    async def export():
+        await asyncio.sleep(0.3)
+        return {"message": "export"}
+
+    @app.get("/events")
+    async def events():
+        async def stream():
+            yield "data: 1\n\n"
+            await asyncio.sleep(0.3)
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.get("/foo")
+    async def foo():
+        return {"message": "foo"}
+
+    app.add_middleware(
+        AdmissionControlMiddleware, max_concurrency=1, queue_size=0, queue_timeout=0.01, exempt=("/export",)
+    )
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            streams = [asyncio.create_task(client.get(path)) for path in ("/export", "/events")]
+            await asyncio.sleep(0.1)
+            # 导出和 SSE 都还没结束，槽位是空的
+            third = await client.get("/foo")
+            return await asyncio.gather(*streams), third
+
+    (exported, streamed), third = asyncio.run(run())
+    assert exported.status_code == 200
+    assert streamed.text == "data: 1\n\n"
+    assert third.status_code == 200
+
+
+def test_disabled_when_max_concurrency_zero(make_client):
+    async def foo():
+        return {"message": "foo"}
+
+    assert make_client({"/foo": foo}, AdmissionControlMiddleware, max_concurrency=0).get("/foo").status_code == 200
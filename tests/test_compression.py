@@ -0,0 +1,156 @@
+import gzip
+import zlib
+
+import pytest
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from app.core.compression import CompressionMiddleware, GzipCompressor, select_encoding
+
+BIG = {"data": [{"id": i, "name": f"user{i}"} for i in range(200)]}
+
+
+async def big():
+    return BIG
+
+
+async def small():
+    return {"message": "hi"}
+
+
+async def png():
+    return Response(b"\x89PNG" + b"\0" * 4096, media_type="image/png")
+
+
+async def precompressed():
+    body = gzip.compress(b"a" * 4096)
+    return Response(body, media_type="text/plain", headers={"Content-Encoding": "gzip"})
+
+
+async def identity():
+    return PlainTextResponse("a" * 4096, headers={"Content-Encoding": "identity"})
+
+
+async def etag():
+    return JSONResponse(BIG, headers={"ETag": '"abc"'})
+
+
+async def stream():
+    async def chunks():
+        for i in range(5):
+            yield f"line {i}\n".encode() * 100
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+
+async def excluded():
+    return BIG
+
+
+async def events():
+    async def chunks():
+        for i in range(3):
+            yield f"data: {i}\n\n" * 100
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+async def partial():
+    body = b"a" * 4096
+    return Response(body, status_code=206, media_type="text/plain", headers={"Content-Range": "bytes 0-4095/8192"})
+
+
+ROUTES = {
+    "/big": big,
+    "/small": small,
+    "/png": png,
+    "/precompressed": precompressed,
+    "/identity": identity,
+    "/etag": etag,
+    "/stream": stream,
+    "/excluded/big": excluded,
+    "/events": events,
+    "/partial": partial,
+}
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client(ROUTES, CompressionMiddleware, exclude_paths=("/excluded",))
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("gzip, deflate", "gzip"),
+        ("br;q=1.0, gzip;q=0.8", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("*;q=0.5, gzip;q=0", None),
+        ("identity", None),
+        ("", None),
+    ],
+)
+def test_select_encoding(header, expected):
+    assert select_encoding(header, {"gzip": None}) == expected
+
+
+def test_select_encoding_prefers_order_on_tie():
+    assert select_encoding("gzip, br, zstd", {"zstd": None, "br": None, "gzip": None}) == "zstd"
+    assert select_encoding("gzip, br;q=0.5", {"br": None, "gzip": None}) == "gzip"
+
+
+def test_compresses_large_json(client):
+    resp = client.get("/big", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["vary"] == "Accept-Encoding"
+    assert resp.json() == BIG
+    assert int(resp.headers["content-length"]) < len(resp.content)
+
+
+@pytest.mark.parametrize("path", ["/small", "/png", "/excluded/big", "/identity", "/events", "/partial"])
+def test_not_compressed(path, client):
+    resp = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in resp.headers
+
+
+def test_identity_opt_out_stripped_without_accept_encoding(client):
+    resp = client.get("/identity", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in resp.headers
+    assert resp.text == "a" * 4096
+
+
+def test_no_double_compression(client):
+    resp = client.get("/precompressed", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.text == "a" * 4096
+
+
+def test_client_without_gzip(client):
+    resp = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in resp.headers
+
+
+def test_strong_etag_becomes_weak(client):
+    resp = client.get("/etag", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["etag"] == 'W/"abc"'
+
+
+def test_streaming_compressed_incrementally(client):
+    resp = client.get("/stream", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert "content-length" not in resp.headers
+    assert resp.text == "".join(f"line {i}\n" * 100 for i in range(5))
+
+
+def test_offload_large_bodies(make_client):
+    resp = make_client(ROUTES, CompressionMiddleware, exclude_paths=("/excluded",), offload_size=10).get(
+        "/stream", headers={"Accept-Encoding": "gzip"}
+    )
+    assert resp.text.startswith("line 0")
+
+
+def test_gzip_compressor_sync_flush_is_decodable():
+    compressor = GzipCompressor(6)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    assert decompressor.decompress(compressor.compress(b"hello ", final=False)) == b"hello "
+    assert decompressor.decompress(compressor.compress(b"world", final=True)) == b"world"
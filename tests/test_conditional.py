@@ -0,0 +1,70 @@
+from unittest import mock
+
+import pytest
+from fastapi import Request
+
+from app.core.compression import CompressionMiddleware
+from app.core.conditional import conditional_response, etag_matches, make_etag, not_modified
+
+ITEMS = {"items": [{"id": i, "name": f"item{i}"} for i in range(200)]}
+
+
+@pytest.fixture
+def build():
+    return mock.Mock(return_value=ITEMS)
+
+
+@pytest.fixture
+def routes(build):
+    async def items(request: Request):
+        return conditional_response(request, ITEMS)
+
+    async def versioned(request: Request):
+        if (resp := not_modified(request, version=7)) is not None:
+            return resp
+        return conditional_response(request, build(), version=7)
+
+    return {"/items": items, "/versioned": versioned}
+
+
+def test_etag_matches():
+    etag = make_etag(b"body")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_body_hash_etag(make_client, routes):
+    client = make_client(routes)
+    first = client.get("/items")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    second = client.get("/items", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["etag"] == etag
+
+    assert client.get("/items", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_version_skips_building_payload(make_client, routes, build):
+    client = make_client(routes)
+    etag = client.get("/versioned").headers["etag"]
+    assert build.call_count == 1
+    response = client.get("/versioned", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert build.call_count == 1
+
+
+def test_weak_etag_after_compression(make_client, routes):
+    client = make_client(routes, CompressionMiddleware, minimum_size=100)
+    first = client.get("/items", headers={"Accept-Encoding": "gzip"})
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.headers["etag"].startswith("W/")
+    second = client.get("/items", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["etag"]})
+    assert second.status_code == 304
+    assert "content-encoding" not in second.headers
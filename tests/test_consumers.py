@@ -0,0 +1,55 @@
+import sys
+import time
+from unittest import mock
+
+from app.core import consumers
+from app.core.config import settings
+from app.core.consumers import ConsumerSupervisor, _resolve, consumer
+
+
+def _crash(handlers, bindings):
+    sys.exit(3)
+
+
+def _run_forever(handlers, bindings):
+    while True:
+        time.sleep(0.1)
+
+
+def test_consumer_registry():
+    with mock.patch.object(consumers, "_bindings", []):
+
+        @consumer("foo.test")
+        def foo_cb(body, message):
+            pass
+
+        consumer("foo.test")(foo_cb)
+        bindings = consumers.get_bindings()
+    assert bindings == [("foo.test", f"{__name__}:test_consumer_registry.<locals>.foo_cb")]
+
+
+def test_resolve():
+    assert _resolve(f"{__name__}:_crash") is _crash
+    assert _resolve("app.core.consumers:ConsumerSupervisor.stop") is ConsumerSupervisor.stop
+
+
+def test_supervisor_restarts_crashed_consumer():
+    supervisor = ConsumerSupervisor(1, [], {}, target=_crash, check_interval=0.05)
+    with mock.patch.object(settings, "consumer_restart_backoff", 0.05):
+        supervisor.start()
+        try:
+            first_pid = supervisor.processes[0].pid
+            deadline = time.monotonic() + 30
+            while supervisor.processes[0].pid == first_pid and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert supervisor.processes[0].pid != first_pid
+        finally:
+            supervisor.stop(timeout=5)
+
+
+def test_supervisor_stop_terminates_consumers():
+    supervisor = ConsumerSupervisor(2, [], {}, target=_run_forever, check_interval=0.05)
+    supervisor.start()
+    processes = list(supervisor.processes)
+    supervisor.stop(timeout=10)
+    assert all(not p.is_alive() for p in processes)
@@ -0,0 +1,154 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from app.core.fanout import (
+    POLICY_COALESCE,
+    POLICY_DROP,
+    FanoutHub,
+    Subscription,
+    broadcast,
+    broadcast_sync,
+    close_subscriptions,
+    sse_response,
+    stop_hub,
+    topic_matches,
+    websocket_pump,
+)
+
+
+@pytest.mark.parametrize(
+    "pattern, routing_key, expected",
+    [
+        ("foo.test", "foo.test", True),
+        ("foo.*", "foo.test", True),
+        # 和 kombu redis transport 的 Worker.on 一致，* 和 # 都会跨过 .
+        ("foo.*", "foo.test.bar", True),
+        ("foo.#", "foo", False),
+        ("foo.#", "foo.a.b", True),
+        ("#.bar", "foo.a.bar", True),
+        ("#", "anything.at.all", True),
+        ("*.test", "test", False),
+        ("user.#.updated", "user.1.profile.updated", True),
+        ("user.#.updated", "user.updated", False),
+    ],
+)
+def test_topic_matches(pattern, routing_key, expected):
+    assert topic_matches(pattern, routing_key) is expected
+
+
+def test_coalesce_keeps_latest_per_key():
+    async def run():
+        subscription = Subscription(["#"], maxsize=2, policy=POLICY_COALESCE)
+        subscription.put_nowait("a", 1)
+        subscription.put_nowait("b", 1)
+        subscription.put_nowait("a", 2)
+        # 满了，丢最老的 a
+        subscription.put_nowait("c", 1)
+        items = [await subscription.get(timeout=0.1) for _ in range(3)]
+        return items, subscription.dropped
+
+    items, dropped = asyncio.run(run())
+    assert items == [("b", 1), ("c", 1), None]
+    assert dropped == 2
+
+
+def test_slow_client_dropped():
+    async def run():
+        hub = FanoutHub(queue_size=2, policy=POLICY_DROP)
+        with mock.patch.object(hub, "_ensure_started"):
+            async with hub.subscribe(["user.*"]) as slow, hub.subscribe(["user.*"], queue_size=10) as fast:
+                for i in range(3):
+                    hub.dispatch(f"user.{i}", {"n": i})
+                hub.dispatch("order.1", {"n": 99})
+                received = [item async for item in _take(fast, 3)]
+                return slow.closed, [item async for item in slow], received, hub.stats()
+
+    slow_closed, slow_items, received, stats = asyncio.run(run())
+    assert slow_closed
+    assert slow_items == []
+    assert received == [("user.0", {"n": 0}), ("user.1", {"n": 1}), ("user.2", {"n": 2})]
+    assert stats["dropped_clients"] == 1
+    assert stats["received"] == 4
+
+
+async def _take(subscription, n):
+    for _ in range(n):
+        yield await subscription.__anext__()
+
+
+def test_upstream_message_handling():
+    hub = FanoutHub(channel_prefix="fanout.")
+    with mock.patch.object(hub, "dispatch") as dispatch:
+        hub._handle({"type": "pmessage", "channel": b"fanout.user.1", "data": b'{"n": 1}'})
+        hub._handle({"type": "psubscribe", "channel": b"fanout.*", "data": 1})
+        hub._handle({"type": "pmessage", "channel": b"fanout.user.1", "data": b"not json"})
+    dispatch.assert_called_once_with("user.1", {"n": 1})
+    assert hub.counters["bad_messages"] == 1
+
+
+def test_sse_stream():
+    async def run():
+        hub = FanoutHub()
+        with mock.patch.object(hub, "_ensure_started"):
+            response = sse_response(["user.#"], hub=hub, heartbeat=0.05)
+            body = response.body_iterator
+            ping = await body.__anext__()
+            hub.dispatch("user.1", {"name": "张三"})
+            event = await body.__anext__()
+            await body.aclose()
+            return ping, event, len(hub.subscriptions)
+
+    ping, event, remaining = asyncio.run(run())
+    assert ping == ": ping\n\n"
+    assert event == 'event: user.1\ndata: {"name":"张三"}\n\n'
+    assert remaining == 0
+
+
+async def _collect(iterator):
+    return [chunk async for chunk in iterator]
+
+
+def test_shutdown_ends_streams():
+    async def run():
+        hub = FanoutHub()
+        with mock.patch.object(hub, "_ensure_started"), mock.patch("app.core.fanout._hub", hub):
+            response = sse_response(["user.#"], hub=hub, heartbeat=10)
+            chunks = asyncio.create_task(_collect(response.body_iterator))
+            await asyncio.sleep(0)
+            hub.dispatch("user.1", {"id": 1})
+            # MyServer.shutdown 一开始就调用，不用等 heartbeat
+            close_subscriptions()
+            events = await asyncio.wait_for(chunks, timeout=1)
+
+            # 关闭以后新来的订阅直接结束
+            websocket = mock.AsyncMock()
+            await asyncio.wait_for(websocket_pump(websocket, ["user.#"], hub=hub), timeout=1)
+            return events, websocket, hub.subscriptions
+
+    events, websocket, remaining = asyncio.run(run())
+    assert events == ['event: user.1\ndata: {"id":1}\n\n']
+    websocket.close.assert_awaited_once_with(code=1001)
+    assert remaining == set()
+
+
+def test_broadcast_reuses_client():
+    client = mock.AsyncMock()
+
+    async def run():
+        await broadcast("user.1", {"id": 1}, redis_url="redis://fanout-test/0")
+        await broadcast("user.2", {"id": 2}, redis_url="redis://fanout-test/0")
+        await stop_hub()
+
+    with mock.patch("redis.asyncio.from_url", return_value=client) as from_url:
+        asyncio.run(run())
+    from_url.assert_called_once_with("redis://fanout-test/0")
+    assert client.publish.await_count == 2
+    client.aclose.assert_awaited_once()
+
+    with mock.patch("redis.Redis.from_url") as from_url:
+        broadcast_sync("user.1", {"id": 1}, redis_url="redis://fanout-test/1")
+        broadcast_sync("user.2", {"id": 2}, redis_url="redis://fanout-test/1")
+    from_url.assert_called_once_with("redis://fanout-test/1")
+    assert from_url.return_value.publish.call_count == 2
@@ -1,11 +1,21 @@
 import logging
 import os
+import threading
+import time
 from unittest import mock
 
 import pytest
 
 from app.core.config import settings
-from app.core.log import InterceptHandler, Rotator, add_file_log, get_log_level, setup_logging
+from app.core.log import (
+    BackgroundFileWriter,
+    InterceptHandler,
+    Rotator,
+    add_file_log,
+    get_log_level,
+    logger,
+    setup_logging,
+)
 
 
 # Helper function to clean up environment variables
@@ -268,10 +278,14 @@ def test_add_file_log_single_process(mock_get_context, mock_rotator_cls, mock_lo
     mock_logger_configure.assert_called_once_with(patcher=None)
     mock_logger_add.assert_called_once()
     args, kwargs = mock_logger_add.call_args
-    assert args[0] == log_path
+    # 单进程时由后台线程写文件
+    writer = args[0]
+    assert isinstance(writer, BackgroundFileWriter)
+    assert writer.name == log_path
     assert kwargs["enqueue"] is False
     assert kwargs["context"] is None
-    assert kwargs["rotation"] == mock_rotator_instance.should_rotate
+    assert writer.rotation == mock_rotator_instance.should_rotate
+    writer.stop()
     # Clean up created file if any (though it's mocked here)
     if os.path.exists(log_path):
         os.remove(log_path)
@@ -297,6 +311,7 @@ def test_add_file_log_multi_process(mock_get_context, mock_rotator_cls, mock_log
     mock_logger_add.assert_called_once()
     args, kwargs = mock_logger_add.call_args
     assert args[0] == log_path
+    assert kwargs["rotation"] == mock_rotator_instance.should_rotate
     assert kwargs["enqueue"] is True
     assert kwargs["context"] == mock_spawn_context
     if os.path.exists(log_path):
@@ -324,13 +339,15 @@ def test_add_file_log_with_real_rotator_instantiation(mock_logger_configure, moc
 
     mock_logger_add.assert_called_once()
     args, kwargs = mock_logger_add.call_args
+    writer = args[0]
+    writer.stop()
     # Check that the rotation function passed is from a Rotator instance
-    assert callable(kwargs["rotation"])
-    assert hasattr(kwargs["rotation"], "__self__")  # Bound method
-    assert isinstance(kwargs["rotation"].__self__, Rotator)
+    assert callable(writer.rotation)
+    assert hasattr(writer.rotation, "__self__")  # Bound method
+    assert isinstance(writer.rotation.__self__, Rotator)
 
     # Verify rotator was initialized with settings
-    rotator_instance = kwargs["rotation"].__self__
+    rotator_instance = writer.rotation.__self__
     assert rotator_instance._size_limit == settings.log_rotation_size
 
     expected_rotation_time_obj = datetime.datetime.strptime(settings.log_rotation_time, "%H:%M").time()
@@ -345,3 +362,93 @@ def test_add_file_log_with_real_rotator_instantiation(mock_logger_configure, moc
 
     if os.path.exists(log_path):
         os.remove(log_path)
+
+
+# Tests for BackgroundFileWriter
+def test_background_writer_flushes_on_remove(tmp_path):
+    log_path = tmp_path / "app.log"
+    writer = BackgroundFileWriter(str(log_path))
+    handler_id = logger.add(writer, format="{message}", colorize=False)
+    try:
+        for i in range(500):
+            logger.info(f"line {i}")
+    finally:
+        logger.remove(handler_id)
+    assert log_path.read_text().splitlines() == [f"line {i}" for i in range(500)]
+
+
+def test_background_writer_rotates_in_writer_thread(tmp_path):
+    log_path = tmp_path / "app.log"
+    rotation = Rotator(size=300, at=datetime.time(0, 0)).should_rotate
+    # 轮转按批判断，批小一点才会轮转多次
+    writer = BackgroundFileWriter(str(log_path), batch_size=10, rotation=rotation)
+    handler_id = logger.add(writer, format="{message}", colorize=False)
+    try:
+        for i in range(100):
+            logger.info(f"line {i:04d}")
+    finally:
+        logger.remove(handler_id)
+    files = sorted(tmp_path.iterdir())
+    assert len(files) > 1
+    assert sum(len(f.read_text().splitlines()) for f in files) == 100
+
+
+@pytest.mark.parametrize("overflow", ["drop_new", "drop_old"])
+def test_background_writer_overflow(tmp_path, overflow):
+    log_path = tmp_path / "app.log"
+    writer = BackgroundFileWriter(str(log_path), queue_size=2, overflow=overflow)
+    blocked = mock.Mock()
+    # 让写线程卡在第一批上，队列就会满
+    release = threading.Event()
+    original = writer._sink.write
+
+    def slow_write(message):
+        blocked()
+        release.wait(5)
+        original(message)
+
+    writer._sink.write = slow_write
+    handler_id = logger.add(writer, format="{message}", colorize=False)
+    try:
+        logger.info("first")
+        while not blocked.called:
+            time.sleep(0.01)
+        for i in range(5):
+            logger.info(f"line {i}")
+        release.set()
+    finally:
+        logger.remove(handler_id)
+    lines = log_path.read_text().splitlines()
+    assert lines[0] == "first"
+    assert lines[-1] == "... 3 log records dropped, log queue full"
+    expected = ["line 0", "line 1"] if overflow == "drop_new" else ["line 3", "line 4"]
+    assert lines[1:-1] == expected
+
+
+def test_background_writer_drop_old_keeps_stop_marker(tmp_path):
+    writer = BackgroundFileWriter(str(tmp_path / "app.log"), queue_size=1, overflow="drop_old")
+    release = threading.Event()
+    blocked = threading.Event()
+
+    def slow_write(message):
+        blocked.set()
+        release.wait(5)
+
+    class Message(str):
+        record = None
+
+    writer._sink.write = slow_write
+    writer.write(Message("first"))
+    assert blocked.wait(5)
+    # stop() 刚放进结束标记时，另一个线程的 write 已经过了 _stopped 的检查，队列是满的
+    writer._queue.put_nowait(None)
+    writer.write(Message("late"))
+    assert list(writer._queue.queue) == [None]
+    release.set()
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
+
+
+def test_background_writer_invalid_overflow(tmp_path):
+    with pytest.raises(ValueError):
+        BackgroundFileWriter(str(tmp_path / "app.log"), overflow="nope")
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+import zipfile
+from unittest import mock
+
+import pytest
+
+from app.core.log_search import LogIndex, main
+
+RID_A = "1e6d2857-fcfe-4f39-913a-470fa7f694d4"
+RID_B = "5b0cfe3c-8f0e-4a43-bf6c-4d7f0b1b2d11"
+
+
+def text_line(rid, message, ts="2022-06-16 at 16:07:51"):
+    return f"{ts} | INFO | {rid} | {message}\n"
+
+
+def json_line(rid, message):
+    record = {"text": text_line(rid, message), "record": {"extra": {"request_id": rid}, "message": message}}
+    return json.dumps(record) + "\n"
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    archived = text_line(RID_A, "old request received") + text_line(None, "Started server process")
+    archive_path = tmp_path / "app.2022-06-15_00-00-00_000000.log.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("app.2022-06-15_00-00-00_000000.log", archived)
+    os.utime(archive_path, (time.time() - 100, time.time() - 100))
+
+    active = tmp_path / "app.log"
+    active.write_text(
+        text_line(None, "Application startup complete.")
+        + text_line(RID_A, "dep start")
+        + text_line(RID_B, "message from foo hanlder")
+        + "2022-06-16 at 16:07:52 | ERROR | " + RID_A + " | boom\n"
+        + "Traceback (most recent call last):\n"
+        + "ValueError: boom\n"
+        + text_line(RID_A, "request finished")
+    )
+    return tmp_path
+
+
+def test_search_across_archive_and_active(log_dir):
+    index = LogIndex(str(log_dir / "app.log"))
+    assert index.update() == 5
+    lines = index.search(RID_A)
+    assert [line.rsplit(" | ", 1)[1].splitlines()[0] for line in lines] == [
+        "old request received",
+        "dep start",
+        "boom",
+        "request finished",
+    ]
+    assert lines[2].endswith("ValueError: boom")
+    assert index.search("missing") == []
+    index.close()
+
+
+def test_incremental_update(log_dir):
+    index = LogIndex(str(log_dir / "app.log"))
+    index.update()
+    assert index.update() == 0
+
+    with open(log_dir / "app.log", "a") as f:
+        f.write(text_line(RID_B, "second request"))
+        f.write("2022-06-16 at 16:07:53 | INFO | " + RID_B)  # 写了一半的行
+    assert index.update() == 1
+    with open(log_dir / "app.log", "a") as f:
+        f.write(" | finished\n")
+    assert index.update() == 1
+    assert len(index.search(RID_B)) == 3
+    index.close()
+
+
+def test_rotated_active_file_is_rescanned(log_dir):
+    index = LogIndex(str(log_dir / "app.log"))
+    index.update()
+    os.remove(log_dir / "app.log")
+    (log_dir / "app.log").write_text(text_line(RID_B, "after rotation"))
+    index.update()
+    assert index.search(RID_A)[-1].endswith("old request received")
+    assert index.search(RID_B) == [text_line(RID_B, "after rotation").rstrip("\n")]
+    index.close()
+
+
+def test_file_removed_while_indexing(log_dir):
+    index = LogIndex(str(log_dir / "app.log"))
+    index.update()
+    archive = str(next(log_dir.glob("*.zip")))
+    # retention 在列目录和打开文件之间删掉了压缩包
+    with mock.patch.object(LogIndex, "files", return_value=[archive, str(log_dir / "app.log")]):
+        os.remove(archive)
+        assert index.update() == 0
+    assert index.search(RID_A)[0].endswith("dep start")
+    index.close()
+
+
+def test_json_logs(tmp_path):
+    path = tmp_path / "app.log"
+    path.write_text(json_line(RID_A, "dep start") + json_line(RID_B, "other") + json_line(RID_A, "done"))
+    index = LogIndex(str(path))
+    index.update()
+    assert [json.loads(line)["record"]["message"] for line in index.search(RID_A)] == ["dep start", "done"]
+    index.close()
+
+
+def test_cli(log_dir, capsys):
+    assert main([RID_B, "--log", str(log_dir / "app.log")]) == 0
+    assert "message from foo hanlder" in capsys.readouterr().out
+    assert main(["missing", "--log", str(log_dir / "app.log"), "--reindex"]) == 1
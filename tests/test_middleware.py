@@ -0,0 +1,61 @@
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from app.core.admission import AdmissionController
+from app.core.middleware import RequestContextLogMiddleware, get_request_id
+
+
+async def foo():
+    return {"request_id": get_request_id()}
+
+
+async def boom():
+    raise RuntimeError("boom")
+
+
+ROUTES = {"/foo": foo, "/boom": boom}
+
+
+def test_request_id_header_matches_context(make_client):
+    client = make_client(ROUTES, RequestContextLogMiddleware, raise_server_exceptions=False)
+    resp = client.get("/foo")
+    assert resp.headers["X-Request-ID"] == resp.json()["request_id"]
+    assert get_request_id() is None
+
+
+def test_single_access_line(make_client):
+    client = make_client(ROUTES, RequestContextLogMiddleware, raise_server_exceptions=False)
+    with mock.patch("app.core.middleware.logger") as mock_logger:
+        resp = client.get("/foo?x=1")
+    mock_logger.info.assert_called_once()
+    (line,), kwargs = mock_logger.info.call_args
+    assert kwargs == {}
+    assert '"GET /foo" 200' in line
+    assert f"{len(resp.content)}B" in line
+    assert line.endswith("ms")
+
+
+def test_access_line_on_exception(make_client):
+    client = make_client(ROUTES, RequestContextLogMiddleware, raise_server_exceptions=False)
+    with mock.patch("app.core.middleware.logger") as mock_logger:
+        assert client.get("/boom").status_code == 500
+    (line,), _ = mock_logger.info.call_args
+    assert '"GET /boom" 500' in line
+
+
+def test_access_line_for_shed_requests():
+    import main
+
+    # user_middleware[0] 是最外层，admission / 限流拒掉的请求也要有访问日志
+    assert main.app.user_middleware[0].cls is RequestContextLogMiddleware
+    client = TestClient(main.app)
+    with (
+        mock.patch.object(AdmissionController, "acquire", mock.AsyncMock(return_value=False)),
+        mock.patch("app.core.middleware.logger") as mock_logger,
+    ):
+        resp = client.get("/foo")
+    assert resp.status_code == 503
+    assert "X-Request-ID" in resp.headers
+    (line,), _ = mock_logger.info.call_args
+    assert '"GET /foo" 503' in line
@@ -0,0 +1,198 @@
+import json
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from app.core import kombu_message
+from app.core.outbox import Outbox, SpoolFullError
+
+
+class FakeBroker:
+    def __init__(self):
+        self.up = True
+        self.received = []
+
+    def send(self, msg, routing_key):
+        if not self.up:
+            raise ConnectionError("broker down")
+        if msg == "poison":
+            raise TypeError("cannot encode")
+        self.received.append((msg, routing_key))
+
+    def probe(self):
+        if not self.up:
+            raise ConnectionError("broker down")
+
+
+def make_outbox(tmp_path, broker, **kwargs):
+    kwargs.setdefault("fsync_interval", 0.01)
+    kwargs.setdefault("retry_interval", 0.02)
+    outbox = Outbox(broker.send, directory=str(tmp_path), **kwargs)
+    outbox.start()
+    return outbox
+
+
+def wait_for(predicate, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_replays_in_order_after_outage(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker)
+    try:
+        assert not outbox.spooling
+        outbox.mark_unhealthy()
+        for i in range(5):
+            outbox.append({"n": i}, "foo.test")
+        assert outbox.spooling
+        time.sleep(0.1)
+        assert broker.received == []
+
+        broker.up = True
+        assert wait_for(lambda: not outbox.spooling)
+        assert broker.received == [({"n": i}, "foo.test") for i in range(5)]
+        assert os.path.getsize(outbox.path) == 0
+    finally:
+        outbox.stop()
+
+
+def test_bounded_size(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker, max_bytes=100)
+    try:
+        outbox.mark_unhealthy()
+        outbox.append("x" * 10, "k")
+        with pytest.raises(SpoolFullError):
+            outbox.append("x" * 100, "k")
+        assert outbox.stats()["dropped"] == 1
+    finally:
+        outbox.stop()
+
+
+def test_restart_resumes_and_drops_torn_record(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker, retry_interval=60)
+    outbox.mark_unhealthy()
+    outbox.append("first", "k")
+    outbox.append("second", "k")
+    outbox.stop()
+    # 模拟写了一半就崩溃
+    with open(outbox.path, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    broker.up = True
+    restarted = make_outbox(tmp_path, broker)
+    try:
+        assert restarted.path == outbox.path
+        assert restarted.spooling
+        assert wait_for(lambda: not restarted.spooling)
+        assert broker.received == [("first", "k"), ("second", "k")]
+    finally:
+        restarted.stop()
+
+
+def test_processes_claim_separate_files(tmp_path):
+    broker = FakeBroker()
+    first = make_outbox(tmp_path, broker)
+    second = make_outbox(tmp_path, broker)
+    try:
+        assert first.path != second.path
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_publish_spools_when_broker_down(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker, retry_interval=60)
+    try:
+        with (
+            mock.patch.object(kombu_message, "_outbox", outbox),
+            mock.patch.object(kombu_message, "_send", side_effect=OSError("connection refused")) as send,
+        ):
+            kombu_message.publish({"n": 1}, "foo.test")
+            kombu_message.publish({"n": 2}, "foo.test")
+        # 第一次失败以后不再直接发
+        assert send.call_count == 1
+        assert outbox.stats()["spooled"] == 2
+    finally:
+        outbox.stop()
+
+
+def test_poison_record_dead_lettered(tmp_path):
+    broker = FakeBroker()
+    outbox = make_outbox(tmp_path, broker, probe=broker.probe, max_attempts=3)
+    try:
+        outbox.mark_unhealthy()
+        for msg in ("first", "poison", "second"):
+            outbox.append(msg, "k")
+        assert wait_for(lambda: not outbox.spooling)
+        assert broker.received == [("first", "k"), ("second", "k")]
+        assert outbox.stats()["dead_lettered"] == 1
+        with open(f"{outbox.path}.dead") as f:
+            assert json.loads(f.read()) == {"msg": "poison", "routing_key": "k"}
+    finally:
+        outbox.stop()
+
+
+def test_outage_does_not_dead_letter(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker, probe=broker.probe, max_attempts=1)
+    try:
+        outbox.mark_unhealthy()
+        outbox.append("first", "k")
+        time.sleep(0.1)
+        assert outbox.stats().get("dead_lettered", 0) == 0
+        broker.up = True
+        assert wait_for(lambda: not outbox.spooling)
+        assert broker.received == [("first", "k")]
+    finally:
+        outbox.stop()
+
+
+def test_probe_switches_to_spooling(tmp_path):
+    broker = FakeBroker()
+    outbox = make_outbox(tmp_path, broker, probe=broker.probe, probe_interval=0.02)
+    try:
+        assert not outbox.spooling
+        broker.up = False
+        # 没有任何发送失败，后台线程自己发现 broker 挂了
+        assert wait_for(lambda: outbox.spooling)
+        # 文件是空的也要一直保持落盘，直到 probe 成功
+        for _ in range(10):
+            time.sleep(0.03)
+            assert not outbox.healthy
+        broker.up = True
+        assert wait_for(lambda: outbox.healthy)
+    finally:
+        outbox.stop()
+
+
+def test_publish_drops_when_spool_full(tmp_path):
+    broker = FakeBroker()
+    broker.up = False
+    outbox = make_outbox(tmp_path, broker, max_bytes=10, retry_interval=60)
+    try:
+        outbox.mark_unhealthy()
+        with (
+            mock.patch.object(kombu_message, "_outbox", outbox),
+            mock.patch.object(kombu_message, "logger") as mock_logger,
+        ):
+            kombu_message.publish({"n": 1}, "foo.test")
+        (message,), _ = mock_logger.error.call_args
+        assert message.startswith("message to foo.test dropped")
+        assert outbox.stats()["dropped"] == 1
+    finally:
+        outbox.stop()
@@ -0,0 +1,69 @@
+import os
+import signal
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from app.core.profiler import SamplingProfiler, collapse_stack, install_signal_handler, profiler
+
+
+def busy_function(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_collapse_stack():
+    frame = mock.Mock()
+    frame.f_code.co_name = "inner"
+    frame.f_code.co_filename = "/app/main.py"
+    frame.f_code.co_firstlineno = 10
+    frame.f_back.f_code.co_name = "outer;x"
+    frame.f_back.f_code.co_filename = "/app/core/view.py"
+    frame.f_back.f_code.co_firstlineno = 3
+    frame.f_back.f_back = None
+    assert collapse_stack(frame, "MainThread") == "MainThread;outer:x (view.py:3);inner (main.py:10)"
+
+
+def test_sample_and_write(tmp_path):
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_function, args=(stop,), name="busy")
+    thread.start()
+    try:
+        counts = SamplingProfiler.sample(duration=0.1, rate=200)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert any(stack.startswith("busy;") and "busy_function" in stack for stack in counts)
+    assert not any("sample (profiler.py" in stack for stack in counts)
+
+    path = SamplingProfiler.write(counts, str(tmp_path))
+    lines = open(path).read().splitlines()
+    assert os.path.basename(path).startswith(f"profile-{os.getpid()}-")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_only_one_capture_at_a_time(tmp_path):
+    p = SamplingProfiler()
+    assert p.start(duration=0.2, rate=50, output_dir=str(tmp_path)) is True
+    assert p.running
+    assert p.start(duration=0.2, rate=50, output_dir=str(tmp_path)) is False
+    deadline = time.time() + 5
+    while p.running and time.time() < deadline:
+        time.sleep(0.01)
+    assert not p.running
+    assert len(os.listdir(tmp_path)) == 1
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR2"), reason="no SIGUSR2")
+def test_signal_handler_starts_profiler():
+    original = signal.getsignal(signal.SIGUSR2)
+    try:
+        with mock.patch.object(profiler, "start") as mock_start:
+            assert install_signal_handler() is True
+            signal.raise_signal(signal.SIGUSR2)
+        mock_start.assert_called_once_with()
+    finally:
+        signal.signal(signal.SIGUSR2, original)
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from unittest import mock
+
+from app.core import ratelimit
+from app.core.ratelimit import MemoryBackend, RateLimitMiddleware, RedisBackend, TokenBucket
+
+
+async def foo():
+    return {"message": "foo"}
+
+
+async def heavy():
+    return {"message": "heavy"}
+
+
+async def health():
+    return {"message": "ok"}
+
+
+ROUTES = {"/foo": foo, "/api/heavy": heavy, "/health": health}
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, capacity=2, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 1.0
+    assert bucket.take(0.5) == 0.5
+    assert bucket.take(1.0) == 0
+
+
+def test_client_bucket_rejects_with_retry_after(make_client):
+    client = make_client(ROUTES, RateLimitMiddleware, backend=MemoryBackend(), rate=0.5, burst=2)
+    assert client.get("/foo").status_code == 200
+    assert client.get("/foo").status_code == 200
+    before = ratelimit.get_stats().get("rejected:client", 0)
+    resp = client.get("/foo")
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == "2"
+    assert resp.json() == {"detail": "Too Many Requests"}
+    assert ratelimit.get_stats()["rejected:client"] == before + 1
+
+
+def test_route_bucket_and_exempt(make_client):
+    client = make_client(
+        ROUTES,
+        RateLimitMiddleware,
+        backend=MemoryBackend(),
+        rate=100,
+        burst=100,
+        routes={"/api": (0.1, 1)},
+        exempt=("/health",),
+    )
+    assert client.get("/api/heavy").status_code == 200
+    assert client.get("/api/heavy").status_code == 429
+    assert client.get("/foo").status_code == 200
+    assert ratelimit.get_stats()["rejected:/api"] >= 1
+
+
+def test_exempt_paths_skip_buckets(make_client):
+    client = make_client(ROUTES, RateLimitMiddleware, backend=MemoryBackend(), rate=0.1, burst=1, exempt=("/health",))
+    for _ in range(5):
+        assert client.get("/health").status_code == 200
+
+
+def test_memory_backend_evicts_idle_buckets():
+    backend = MemoryBackend(max_keys=2)
+    backend.acquire_nowait("a", 1000, 1)
+    backend.acquire_nowait("b", 1000, 1)
+    backend.acquire_nowait("c", 1000, 1)
+    assert len(backend._buckets) <= 2
+
+
+def test_redis_backend_uses_local_lease():
+    with mock.patch("redis.asyncio.from_url"):
+        backend = RedisBackend("redis://localhost", lease=3)
+    backend.script = mock.AsyncMock(return_value=[3, "0"])
+
+    async def run():
+        return [await backend.acquire("c:1", 10, 10) for _ in range(6)]
+
+    assert asyncio.run(run()) == [0.0] * 6
+    assert backend.script.await_count == 2
+
+    backend.script = mock.AsyncMock(return_value=[0, "0.25"])
+    backend._leases.clear()
+    assert asyncio.run(backend.acquire("c:1", 10, 10)) == 0.25
+
+
+def test_redis_backend_bounds_leases():
+    with mock.patch("redis.asyncio.from_url"):
+        backend = RedisBackend("redis://localhost", lease=3, lease_ttl=60, max_keys=3)
+    backend.script = mock.AsyncMock(return_value=[3, "0"])
+
+    async def run(keys):
+        for key in keys:
+            await backend.acquire(key, 10, 10)
+
+    asyncio.run(run(["c:1", "c:2", "c:3", "c:4", "c:5"]))
+    assert list(backend._leases) == ["c:3", "c:4", "c:5"]
+
+    # 过期的先清掉，没过期的留着
+    backend._leases["c:3"] = (2, 0.0)
+    asyncio.run(run(["c:6"]))
+    assert list(backend._leases) == ["c:4", "c:5", "c:6"]
+
+
+def test_redis_backend_falls_back_when_unavailable():
+    with mock.patch("redis.asyncio.from_url"):
+        backend = RedisBackend("redis://localhost")
+    backend.script = mock.AsyncMock(side_effect=ConnectionError("down"))
+
+    async def run():
+        return [await backend.acquire("c:1", 1, 2) for _ in range(3)]
+
+    first, second, third = asyncio.run(run())
+    assert first == second == 0.0
+    assert 0.9 < third <= 1.0
+    # 出错以后 cooldown 期间不再访问 redis
+    assert backend.script.await_count == 1
+
+
+def test_redis_backend_retries_after_cooldown():
+    with mock.patch("redis.asyncio.from_url") as from_url:
+        backend = RedisBackend("redis://localhost", timeout=0.1, cooldown=0.05)
+    assert from_url.call_args.kwargs == {"socket_timeout": 0.1, "socket_connect_timeout": 0.1}
+    backend.script = mock.AsyncMock(side_effect=ConnectionError("down"))
+    asyncio.run(backend.acquire("c:1", 10, 10))
+    time.sleep(0.06)
+    backend.script = mock.AsyncMock(return_value=[5, "0"])
+    assert asyncio.run(backend.acquire("c:1", 10, 10)) == 0.0
+    backend.script.assert_awaited_once()
@@ -0,0 +1,89 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+from pid import PidFile, PidFileError
+
+from app.core import scheduler
+from app.core.config import settings
+
+
+@pytest.fixture(autouse=True)
+def scheduler_settings(tmp_path):
+    with (
+        mock.patch.object(settings, "scheduler_lock_dir", str(tmp_path)),
+        mock.patch.object(settings, "scheduler_failover_interval", 0.05),
+        mock.patch.object(scheduler, "_jobs", []),
+    ):
+        yield
+        scheduler.shutdown_scheduler(wait=False)
+
+
+def hold_lock(tmp_path):
+    pidfile = PidFile(
+        pidname=settings.scheduler_lock_name,
+        piddir=str(tmp_path),
+        register_term_signal_handler=False,
+        register_atexit=False,
+    )
+    pidfile.create()
+    return pidfile
+
+
+def test_scheduled_job_logs_runtime():
+    @scheduler.scheduled_job("interval", seconds=60)
+    def job(x):
+        return x * 2
+
+    wrapper, trigger, kwargs = scheduler._jobs[0]
+    assert trigger == "interval"
+    assert kwargs["seconds"] == 60
+    with mock.patch.object(scheduler.logger, "info") as mock_info:
+        assert wrapper(2) == 4
+    assert "finished in" in mock_info.call_args[0][0]
+
+
+def test_scheduled_job_logs_failure():
+    @scheduler.scheduled_job("interval", seconds=60)
+    def job():
+        raise RuntimeError("boom")
+
+    wrapper = scheduler._jobs[0][0]
+    with mock.patch.object(scheduler.logger, "exception") as mock_exception, pytest.raises(RuntimeError):
+        wrapper()
+    mock_exception.assert_called_once()
+
+
+def test_only_one_leader(tmp_path):
+    ran = threading.Event()
+
+    @scheduler.scheduled_job("interval", seconds=0.01)
+    def job():
+        ran.set()
+
+    assert scheduler.start_scheduler() is True
+    assert scheduler.start_scheduler() is True  # idempotent
+    assert ran.wait(2)
+
+    with pytest.raises(PidFileError):
+        hold_lock(tmp_path)
+
+
+def test_standby_takes_over(tmp_path):
+    leader = hold_lock(tmp_path)
+    assert scheduler.start_scheduler() is False
+    assert scheduler._scheduler is None
+
+    leader.close()
+    deadline = time.time() + 2
+    while scheduler._scheduler is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert scheduler._scheduler is not None
+
+
+def test_lock_dir_created(tmp_path):
+    lock_dir = tmp_path / "missing" / "logs"
+    with mock.patch.object(settings, "scheduler_lock_dir", str(lock_dir)):
+        assert scheduler._try_lead()
+    assert (lock_dir / f"{settings.scheduler_lock_name}.pid").exists()
@@ -225,3 +225,13 @@ def test_myconfig_calls_super_configure_logging(
 
     # We are asserting that UvicornConfig.configure_logging (the super call) was called
     mock_uvicorn_config_logging_arg.assert_called_once_with(config)
+
+
+def test_myconfig_disables_uvicorn_access_log(myconfig_instance_no_init_logging):
+    config = myconfig_instance_no_init_logging
+    assert config.access_log is False
+
+    with mock.patch.object(logger, "add", return_value=None), mock.patch("app.core.server_config.setup_logging"):
+        MyConfig.configure_logging(config)
+    assert logging.getLogger("uvicorn.access").disabled is True
+    logging.getLogger("uvicorn.access").disabled = False
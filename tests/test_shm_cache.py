@@ -0,0 +1,74 @@
+import multiprocessing
+import time
+
+import pytest
+
+from app.core.shm_cache import SharedCache
+
+
+@pytest.fixture
+def cache():
+    cache = SharedCache.create(buckets=4, ways=2, key_size=16, value_size=32)
+    yield cache
+    cache.close()
+    cache.unlink()
+
+
+def test_set_get_delete(cache):
+    assert cache.get(b"a") is None
+    cache.set(b"a", b"1")
+    cache.set(b"b", b"2")
+    assert cache.get(b"a") == b"1"
+    cache.set(b"a", b"updated")
+    assert cache.get(b"a") == b"updated"
+    assert cache.delete(b"a")
+    assert not cache.delete(b"a")
+    assert cache.get(b"a", b"missing") == b"missing"
+    assert cache.get(b"b") == b"2"
+
+
+def test_too_large(cache):
+    with pytest.raises(ValueError):
+        cache.set(b"k", b"x" * 33)
+    with pytest.raises(ValueError):
+        cache.set(b"k" * 17, b"x")
+
+
+def test_ttl(cache):
+    cache.set(b"a", b"1", ttl=0.05)
+    assert cache.get(b"a") == b"1"
+    time.sleep(0.1)
+    assert cache.get(b"a") is None
+
+
+def test_clock_eviction_keeps_recently_used(cache):
+    # 一个 bucket 只有 2 个槽位，写多了只会淘汰，不会出错
+    keys = [f"key-{i}".encode() for i in range(32)]
+    for key in keys:
+        cache.set(key, key)
+        # 访问过的会拿到第二次机会
+        assert cache.get(key) == key
+    present = [key for key in keys if cache.get(key) == key]
+    assert 0 < len(present) <= cache.buckets * cache.ways
+    assert keys[-1] in present
+
+
+def _child(name, queue):
+    cache = SharedCache.attach(name)
+    try:
+        queue.put(cache.get(b"from-parent"))
+        cache.set(b"from-child", b"hello")
+    finally:
+        cache.close()
+
+
+def test_shared_between_processes(cache):
+    cache.set(b"from-parent", b"value")
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child, args=(cache.shm.name, queue))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    assert queue.get(timeout=5) == b"value"
+    assert cache.get(b"from-child") == b"hello"
@@ -0,0 +1,152 @@
+import asyncio
+import csv
+import io
+import json
+import threading
+import time
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, insert, select
+
+from app.core.streaming import RowStreamResponse, server_side_rows
+
+
+@pytest.fixture
+def export_client(make_client):
+    def factory(rows_factory, **kwargs):
+        async def export():
+            return RowStreamResponse(rows_factory(), **kwargs)
+
+        return make_client({"/export": export})
+
+    return factory
+
+
+def sync_rows(n=3):
+    for i in range(n):
+        yield {"id": i, "name": f"user{i}"}
+
+
+async def async_rows(n=3):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield {"id": i, "name": f"user{i}"}
+
+
+@pytest.mark.parametrize("factory", [sync_rows, async_rows])
+def test_stream_json_keeps_envelope(export_client, factory):
+    client = export_client(factory, fmt="json", code=0, msg="ok")
+    resp = client.get("/export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/json")
+    assert resp.json() == {"code": 0, "msg": "ok", "data": [{"id": i, "name": f"user{i}"} for i in range(3)]}
+
+
+def test_stream_json_empty(export_client):
+    client = export_client(lambda: iter([]), fmt="json", code=0, msg="ok")
+    assert client.get("/export").json() == {"code": 0, "msg": "ok", "data": []}
+
+
+def test_stream_ndjson(export_client):
+    client = export_client(async_rows, fmt="ndjson")
+    lines = client.get("/export").text.splitlines()
+    assert [json.loads(line) for line in lines] == [{"id": i, "name": f"user{i}"} for i in range(3)]
+
+
+def test_stream_csv_header_from_first_row(export_client):
+    client = export_client(sync_rows, fmt="csv", filename="users.csv")
+    resp = client.get("/export")
+    assert resp.headers["content-disposition"] == 'attachment; filename="users.csv"'
+    rows = list(csv.reader(io.StringIO(resp.text)))
+    assert rows == [["id", "name"], ["0", "user0"], ["1", "user1"], ["2", "user2"]]
+
+
+def test_stream_small_chunks(export_client):
+    client = export_client(lambda: sync_rows(100), fmt="json", chunk_size=16, batch_size=7)
+    assert len(client.get("/export").json()["data"]) == 100
+
+
+def test_unsupported_format():
+    with pytest.raises(ValueError):
+        RowStreamResponse([], fmt="xml")
+
+
+def test_source_closed_on_disconnect():
+    closed = asyncio.Event()
+
+    async def endless():
+        try:
+            i = 0
+            while True:
+                await asyncio.sleep(0)
+                yield {"id": i}
+                i += 1
+        finally:
+            closed.set()
+
+    async def run():
+        response = RowStreamResponse(endless(), fmt="ndjson", chunk_size=1)
+        chunks = []
+        messages = asyncio.Queue()
+
+        async def receive():
+            return await messages.get()
+
+        async def send(message):
+            chunks.append(message)
+            if len(chunks) == 3:
+                await messages.put({"type": "http.disconnect"})
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+        await asyncio.wait_for(response(scope, receive, send), timeout=5)
+        return response
+
+    response = asyncio.run(run())
+    assert closed.is_set()
+    assert response.rows_sent >= 2
+
+
+def test_server_side_rows():
+    engine = create_engine("sqlite://")
+    metadata = MetaData()
+    users = Table("users", metadata, Column("id", Integer, primary_key=True), Column("name", String))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(users), [{"id": i, "name": f"user{i}"} for i in range(5)])
+
+    with engine.connect() as conn:
+        rows = server_side_rows(conn, select(users).order_by(users.c.id), yield_per=2)
+        assert [dict(row) for row in rows] == [{"id": i, "name": f"user{i}"} for i in range(5)]
+
+
+def test_sync_source_closed_on_disconnect():
+    # 数据库游标这种同步的来源，断开时正在线程池里取数据，也要马上关掉，不能等垃圾回收
+    closed = threading.Event()
+
+    def endless():
+        try:
+            i = 0
+            while True:
+                time.sleep(0.01)
+                yield {"id": i}
+                i += 1
+        finally:
+            closed.set()
+
+    async def run():
+        # 外面还持有引用（比如 session 里的游标），不能靠引用计数归零来关
+        source = endless()
+        response = RowStreamResponse(source, fmt="ndjson", chunk_size=1, batch_size=1)
+
+        async def receive():
+            await asyncio.sleep(0.1)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.3"}}
+        await asyncio.wait_for(response(scope, receive, send), timeout=5)
+        return closed.is_set()
+
+    assert asyncio.run(run())
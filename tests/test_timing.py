@@ -0,0 +1,100 @@
+import asyncio
+import time
+from unittest import mock
+
+from fastapi import Depends
+from sqlalchemy import create_engine, text
+
+from app.core import timing
+from app.core.config import settings
+from app.core.middleware import RequestContextLogMiddleware
+from app.core.timing import instrument_engine, span, timed_threadpool
+
+
+@span("dep")
+async def dep():
+    return "foo"
+
+
+def work():
+    time.sleep(0.01)
+
+
+async def root(value: str = Depends(dep)):
+    await timed_threadpool(work)
+    with span("db call"):
+        pass
+    return {"message": value}
+
+
+ROUTES = {"/": root}
+
+
+def parse_server_timing(header):
+    result = {}
+    for part in header.split(", "):
+        name, dur = part.split(";dur=")
+        result[name] = float(dur)
+    return result
+
+
+def test_server_timing_header(make_client):
+    resp = make_client(ROUTES, RequestContextLogMiddleware).get("/")
+    assert resp.json() == {"message": "foo"}
+    metrics = parse_server_timing(resp.headers["Server-Timing"])
+    assert set(metrics) == {"dep", "work.wait", "work", "db_call", "total"}
+    assert metrics["work"] >= 10
+    assert metrics["total"] >= metrics["work"]
+
+
+def test_server_timing_disabled(make_client):
+    with mock.patch.object(settings, "server_timing_enabled", False):
+        resp = make_client(ROUTES, RequestContextLogMiddleware).get("/")
+    assert "Server-Timing" not in resp.headers
+
+
+def test_slow_request_logs_span_tree(make_client):
+    with (
+        mock.patch.object(settings, "slow_request_ms", 0),
+        mock.patch("app.core.middleware.logger") as mock_logger,
+    ):
+        make_client(ROUTES, RequestContextLogMiddleware).get("/")
+    (message,), _ = mock_logger.warning.call_args
+    assert message.startswith('slow request "GET /"')
+    assert "\n  work.wait " in message
+    assert "\n  work " in message
+
+
+def test_span_outside_request_is_noop():
+    with span("nothing") as s:
+        pass
+    assert s._span is None
+    assert timing.current_spans() == []
+
+
+def test_nested_spans_tree():
+    async def run():
+        token = timing.start_request()
+        try:
+            async with span("outer"):
+                with span("inner"):
+                    pass
+            return list(timing.current_spans())
+        finally:
+            timing.end_request(token)
+
+    outer, inner = asyncio.run(run())
+    assert inner.parent is outer
+    assert timing.format_tree([outer, inner]).splitlines()[1].startswith("    inner ")
+
+
+def test_instrument_engine():
+    engine = instrument_engine(create_engine("sqlite://"))
+    token = timing.start_request()
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("select 1"))
+        assert [s.name for s in timing.current_spans()].count("db") == 1
+        assert all(s.end is not None for s in timing.current_spans())
+    finally:
+        timing.end_request(token)
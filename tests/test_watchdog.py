@@ -0,0 +1,68 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+from app.core.middleware import _request_id_ctx_var
+from app.core.watchdog import LagHistogram, LoopWatchdog
+
+
+def test_histogram_snapshot():
+    histogram = LagHistogram(buckets=(1, 10))
+    for lag in (0.5, 5, 50):
+        histogram.observe(lag)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"1": 1, "10": 2, "+Inf": 3}
+    assert snapshot["count"] == 3
+    assert snapshot["max"] == 50
+
+
+def test_watchdog_reports_blocking_call():
+    def blocking_handler():
+        time.sleep(0.3)
+
+    async def run():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), interval=0.02, threshold_ms=50)
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.05)
+
+            async def request():
+                _request_id_ctx_var.set("blocked-request")
+                blocking_handler()
+
+            await asyncio.create_task(request())
+            await asyncio.sleep(0.1)
+        finally:
+            watchdog.stop()
+        return watchdog
+
+    request_ids = []
+    with mock.patch("app.core.watchdog.logger") as mock_logger:
+        mock_logger.warning.side_effect = lambda _: request_ids.append(_request_id_ctx_var.get())
+        watchdog = asyncio.run(run())
+
+    (message,), _ = mock_logger.warning.call_args
+    assert "event loop blocked" in message
+    assert "blocking_handler" in message
+    assert request_ids == ["blocked-request"]
+    assert watchdog.histogram.max >= 200
+    assert watchdog.histogram.count >= 2
+
+
+def test_watchdog_reports_histogram_periodically():
+    async def run():
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), interval=0.01, threshold_ms=50, report_interval=0.05)
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            watchdog.stop()
+
+    with mock.patch("app.core.watchdog.logger") as mock_logger:
+        asyncio.run(run())
+
+    (message,), _ = mock_logger.info.call_args
+    assert message.startswith("event loop lag ms: ")
+    snapshot = json.loads(message.removeprefix("event loop lag ms: "))
+    assert snapshot["count"] == snapshot["buckets"]["+Inf"] > 0